@@ -0,0 +1,20 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+
+class TenantJWTAuthentication(JWTAuthentication):
+    # Loads the user together with the company, its storage and owner, so
+    # request.tenant (company.middleware) needs no queries of its own.
+    def get_user(self, validated_token):
+        user = self.user_model.objects.select_related('company__storage', 'company__owner').filter(
+            **{api_settings.USER_ID_FIELD: validated_token.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if user is None or not user.is_active or api_settings.CHECK_REVOKE_TOKEN:
+            # Anything simplejwt might refuse goes through its own checks.
+            return super().get_user(validated_token)
+        return user
+
+
+class TenantJWTScheme(SimpleJWTScheme):
+    target_class = TenantJWTAuthentication
@@ -0,0 +1,28 @@
+class Tenant:
+    # Company and storage of the user making the request. Nothing is kept
+    # here: DRF authenticates inside the view and sets request.user on the
+    # Django request it wraps, so every read goes through the current user,
+    # whose related objects Django caches on the instance.
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def user(self):
+        return self.request.user
+
+    @property
+    def company(self):
+        return getattr(self.user, 'company', None)
+
+    @property
+    def storage(self):
+        return getattr(self.company, 'storage', None)
+
+
+class TenantMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.tenant = Tenant(request)
+        return self.get_response(request)
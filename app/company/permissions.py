@@ -9,5 +9,4 @@ class IsCompanyEmployee(BasePermission):
     message = 'Вы не привязаны к компании'
 
     def has_permission(self, request, view):
-        user = request.user
-        return bool(user.is_authenticated and user.company is not None)
\ No newline at end of file
+        return bool(request.user.is_authenticated and request.tenant.company is not None)
\ No newline at end of file
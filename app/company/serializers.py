@@ -1,8 +1,9 @@
 from rest_framework import serializers
 from .models import Company, Storage
 from authenticate.models import User
+from monitoring.serializers import TimedSerializerMixin
 
-class StorageSerializer(serializers.ModelSerializer):
+class StorageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     company_title = serializers.ReadOnlyField(source='company.title')
     # address = serializers.CharField(required=False, default=None)
     class Meta:
@@ -11,7 +12,7 @@ class StorageSerializer(serializers.ModelSerializer):
         read_only_fields = ['company_title']
 
 
-class CompanySerializer(serializers.ModelSerializer):
+class CompanySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     storage = StorageSerializer(read_only=True)
     owner = serializers.ReadOnlyField(source='owner.email')
 
@@ -20,7 +21,7 @@ class CompanySerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'inn', 'owner', 'storage']
         read_only_fields = ['owner']
 
-class EmployeeSerializer(serializers.ModelSerializer):
+class EmployeeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email', 'is_company_owner', 'company']
@@ -1,3 +1,73 @@
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from core.testing import QueryPlanMixin, create_tenant, create_sales
+from sale.models import Sale
+from sale.services import mismatched_sales
+from .middleware import Tenant
+
+
+class CompanyQueryPlanTests(QueryPlanMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('first', 'second'):
+            user, _ = create_tenant(name)
+        cls.user = user
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.user)
+
+    def test_company(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/company/'))
+
+    def test_company_detail(self):
+        self.assertNoFullScans(lambda: self.client.get(f'/api/v1/companies/{self.user.company_id}/'))
+
+    def test_storage(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/storage/detail/'))
+
+    def test_employees(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/employee/'))
+
+
+class StorageDeleteTests(APITestCase):
+    def test_sale_totals_are_recounted(self):
+        user, client = create_tenant('storage', products=3)
+        create_sales(client, user, 4)
+        self.assertEqual(client.delete('/api/v1/storage/').status_code, 200)
+        sales = Sale.objects.filter(company=user.company)
+        self.assertEqual(sales.count(), 4)
+        self.assertFalse(mismatched_sales(sales).exists())
+        self.assertEqual(set(sales.values_list('items_count', flat=True)), {0})
+
+
+class TenantTests(APITestCase):
+    def test_follows_the_authenticated_user(self):
+        user, _ = create_tenant('tenant')
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        tenant = Tenant(request)
+        # Read before DRF has authenticated the request.
+        self.assertIsNone(tenant.company)
+
+        request.user = user
+        self.assertEqual(tenant.company, user.company)
+        self.assertEqual(tenant.storage, user.company.storage)
+
+    def test_token_user_is_loaded_with_the_tenant(self):
+        user, _ = create_tenant('token')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        with self.assertNumQueries(1):
+            self.assertEqual(client.get('/api/v1/storage/detail/').status_code, 200)
+
+        user.is_active = False
+        user.save()
+        response = client.get('/api/v1/storage/detail/')
+        self.assertEqual((response.status_code, response.data['code']), (401, 'user_inactive'))
+        user.delete()
+        response = client.get('/api/v1/storage/detail/')
+        self.assertEqual((response.status_code, response.data['code']), (401, 'user_not_found'))
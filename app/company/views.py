@@ -6,6 +6,10 @@ from .permissions import IsCompanyOwner, IsCompanyEmployee
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from django.db import transaction
+from sale.models import Sale
+from sale.rollups import rebuild_rollups
+from sale.services import recount_sale_totals
 
 class CompanyViewSet(APIView):
     queryset = Company.objects.all()
@@ -30,11 +34,11 @@ class CompanyViewSet(APIView):
         return Response(company_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def get(self, request, *args, **kwargs):
-        user = self.request.user
-        if user.company is None:
+        company = self.request.tenant.company
+        if company is None:
             return Response({"detail": "У вас нет привязанных компаний."}, status=status.HTTP_400_BAD_REQUEST)
 
-        company_serializer = CompanySerializer(user.company)
+        company_serializer = CompanySerializer(company)
         return Response(company_serializer.data)
 
 class CompanyIdViewSet(APIView):
@@ -44,7 +48,7 @@ class CompanyIdViewSet(APIView):
         company_id = kwargs.get('company_id')
 
         try:
-            company = Company.objects.get(id=company_id)
+            company = Company.objects.select_related('owner', 'storage').get(id=company_id)
         except Company.DoesNotExist:
             return Response({"detail": "Компания с таким id не найдена."}, status=status.HTTP_404_NOT_FOUND)
 
@@ -57,21 +61,20 @@ class CompanyOwnerViewSet(APIView):
     permission_classes = [IsCompanyOwner]
 
     def patch(self, request, *args, **kwargs):
-        user = self.request.user
-        if not hasattr(user, 'company') or user.company is None:
+        company = self.request.tenant.company
+        if company is None:
             return Response({"detail": "У вас нет привязанных компаний."}, status=status.HTTP_400_BAD_REQUEST)
-        company_serializer = CompanySerializer(user.company, data=request.data, partial=True)
+        company_serializer = CompanySerializer(company, data=request.data, partial=True)
         if company_serializer.is_valid():
             company_serializer.save()
             return Response(company_serializer.data, status=status.HTTP_201_CREATED)
         return Response(company_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, *args, **kwargs):
-        user = self.request.user
-        if not hasattr(user, 'company') or user.company is None:
+        company = self.request.tenant.company
+        if company is None:
             return Response({"detail": "У вас нет привязанных компаний."}, status=status.HTTP_400_BAD_REQUEST)
 
-        company = user.company
         company_title = company.title
         company.delete()
 
@@ -85,17 +88,17 @@ class StorageViewSetGet(APIView):
     permission_classes = [IsCompanyEmployee]
 
     def get(self, request, *args, **kwargs):
-        user = self.request.user
+        tenant = self.request.tenant
 
-        if not user.company:
+        if not tenant.company:
             return Response({"detail": "У пользователя нет компании."}, status=status.HTTP_400_BAD_REQUEST)
 
-        company = user.company
+        company = tenant.company
 
-        if not hasattr(company, 'storage') or company.storage is None:
+        if tenant.storage is None:
             return Response({"detail": "У компании нет ни одного склада."}, status=status.HTTP_400_BAD_REQUEST)
 
-        storage_serializer = StorageSerializer(company.storage)
+        storage_serializer = StorageSerializer(tenant.storage)
         storage_serializer.data.update({'company': company.title})
 
         return Response(storage_serializer.data)
@@ -107,14 +110,14 @@ class StorageViewSet(APIView):
     permission_classes = [IsCompanyOwner]
 
     def post(self, request, *args, **kwargs):
-        user = request.user
+        tenant = request.tenant
 
-        if not hasattr(user, 'company') or user.company is None:
+        if tenant.company is None:
             return Response({"detail": "У пользователя нет компании."}, status=status.HTTP_400_BAD_REQUEST)
 
-        company = user.company
+        company = tenant.company
 
-        if Storage.objects.filter(company=company).exists():
+        if tenant.storage is not None:
             return Response({"detail": "Компания уже имеет склад."},
                             status=status.HTTP_400_BAD_REQUEST)
 
@@ -128,15 +131,14 @@ class StorageViewSet(APIView):
 
 
     def patch(self, request, *args, **kwargs):
-        user = self.request.user
-        if not user.company:
+        tenant = self.request.tenant
+        if not tenant.company:
             return Response({"detail": "У пользователя нет компании."}, status=status.HTTP_400_BAD_REQUEST)
 
-        company = user.company
-        if not hasattr(company, 'storage') or company.storage is None:
+        if tenant.storage is None:
             return Response({"detail": "У компании нет ни одного склада."},
                             status=status.HTTP_400_BAD_REQUEST)
-        storage = company.storage
+        storage = tenant.storage
         storage_serializer = StorageSerializer(storage, data=request.data, partial=True)
 
         if storage_serializer.is_valid():
@@ -146,19 +148,22 @@ class StorageViewSet(APIView):
         return Response(storage_serializer.errors,status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, *args, **kwargs):
-        user = self.request.user
+        tenant = self.request.tenant
 
-        if not user.company:
+        if not tenant.company:
             return Response({"detail": "У пользователя нет компании."}, status=status.HTTP_400_BAD_REQUEST)
 
-        company = user.company
+        company = tenant.company
 
-        if not company.storage:
+        if not tenant.storage:
             return Response({"detail": "У компании нет склада для удаления."}, status=status.HTTP_400_BAD_REQUEST)
 
-        storage = company.storage
+        storage = tenant.storage
         storage_address = storage.address
-        storage.delete()
+        with transaction.atomic():
+            storage.delete()
+            recount_sale_totals(Sale.objects.filter(company_id=company.id))
+            rebuild_rollups(company.id)
 
         return Response({"detail": f"Склад по адресу {storage_address} успешно удален."}, status=status.HTTP_200_OK)
 
@@ -169,19 +174,19 @@ class EmployeesViewSet(APIView):
     permission_classes = [IsCompanyOwner]
 
     def get(self, request, *args, **kwargs):
-        user = request.user
+        company = request.tenant.company
 
-        if not user.company:
+        if not company:
             return Response({"detail": "У пользователя нет привязанной компании."}, status=status.HTTP_400_BAD_REQUEST)
 
-        employees = User.objects.filter(company=user.company)
+        employees = User.objects.filter(company=company)
         serializer = self.serializer_class(employees, many=True)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def post(self, request, *args, **kwargs):
-        user = request.user
-        if not user.company:
+        company = request.tenant.company
+        if not company:
             return Response({"detail": "У пользователя нет привязанной компании."}, status=status.HTTP_400_BAD_REQUEST)
 
         employee_email = request.data.get('email')
@@ -197,7 +202,7 @@ class EmployeesViewSet(APIView):
             return Response({"detail": "У сотрудника уже есть привязанная компания."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        employee.company = user.company
+        employee.company = company
         employee.is_company_owner = False
         employee.save()
 
@@ -209,9 +214,9 @@ class EmployeeViewSetDelete(APIView):
     permission_classes = [IsCompanyOwner]
     serializer_class = EmployeeSerializer
     def delete(self, request, *args, **kwargs):
-        user = request.user
+        company = request.tenant.company
 
-        if not user.company:
+        if not company:
             return Response({"detail": "У пользователя нет привязанной компании."}, status=status.HTTP_400_BAD_REQUEST)
 
         employee_id = kwargs.get('employee_id')
@@ -220,7 +225,7 @@ class EmployeeViewSetDelete(APIView):
             return Response({"detail": "Не указан ID сотрудника."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            employee = User.objects.get(id=employee_id, company=user.company)
+            employee = User.objects.get(id=employee_id, company=company)
             employee_email = employee.email
             employee.company = None
             employee.save()
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 
@@ -46,18 +48,75 @@ INSTALLED_APPS = [
     'company.apps.CompanyConfig',
     'supply.apps.SupplyConfig',
     'sale.apps.SaleConfig',
+    'monitoring.apps.MonitoringConfig',
 ]
 
 MIDDLEWARE = [
+    'monitoring.middleware.MetricsMiddleware',
+    'monitoring.middleware.TrafficCaptureMiddleware',
+    'monitoring.middleware.RequestTimingMiddleware',
+    'monitoring.middleware.ViewNameMiddleware',
+    'monitoring.middleware.ProfilingMiddleware',
+    'monitoring.middleware.MemoryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'company.middleware.TenantMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+
+def env_flag(name, default=False):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+# Monitoring is off unless switched on through the environment: each of
+# these wraps every query or request of every worker.
+
+# Per-request query count and timings (Server-Timing, X-Query-Count headers).
+# Requests over the budget or repeating one statement this many times are
+# logged as warnings by the "monitoring" logger. Serializers time their
+# output through monitoring.serializers.TimedSerializerMixin.
+REQUEST_TIMING_ENABLED = env_flag('REQUEST_TIMING_ENABLED')
+REQUEST_QUERY_BUDGET = 30
+REQUEST_DUPLICATE_QUERY_THRESHOLD = 5
+
+# Every statement is aggregated by fingerprint; statements slower than the
+# threshold get their query plan captured. See `manage.py slowqueries`.
+SLOW_QUERY_LOG_ENABLED = env_flag('SLOW_QUERY_LOG_ENABLED')
+SLOW_QUERY_THRESHOLD_MS = 100
+
+# A request carrying this token in the X-Profile header (or ?profile=) is run
+# under cProfile and a stack sampler, at most PROFILING_MAX_PER_MINUTE times
+# per worker. Results are listed by `manage.py profiles`. None disables it.
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN') or None
+PROFILING_MAX_PER_MINUTE = 5
+PROFILING_SAMPLE_INTERVAL_MS = 5
+
+# View class names (or URL names, e.g. "admin:supply_product_changelist")
+# whose requests are traced with tracemalloc; see `manage.py memory_report`.
+# Tracing slows those requests down, so keep the list short.
+MEMORY_PROFILE_VIEWS = []
+MEMORY_PROFILE_FRAMES = 10
+
+# Per-view request, error, query counters and latency histograms, served in
+# Prometheus text format at /metrics to the listed addresses (None: anyone).
+METRICS_ENABLED = env_flag('METRICS_ENABLED')
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Sanitized API requests (shape of the body, pseudonymous user and company,
+# timing) are appended as NDJSON to TRAFFIC_CAPTURE_FILE, or one file per
+# process in the monitoring dir. Replay them with `manage.py replay_traffic`.
+TRAFFIC_CAPTURE_ENABLED = env_flag('TRAFFIC_CAPTURE_ENABLED')
+TRAFFIC_CAPTURE_FILE = None
+TRAFFIC_CAPTURE_SAMPLE_RATE = 1.0
+
+# Shared by all worker processes for monitoring snapshots (temp dir if None).
+MONITORING_DIR = None
+
 ROOT_URLCONF = 'core.urls'
 
 
@@ -86,9 +145,37 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts so concurrent sales
+            # wait for each other instead of failing with "database is locked".
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # The concurrent sales test needs threads with their own connections
+        # to one database; the in-memory test database cannot give it that.
+        'TEST': {'NAME': Path(tempfile.gettempdir()) / 'crm-test.sqlite3'},
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'crm',
+    },
+    # With several worker processes point analytics at a shared cache, e.g.
+    # 'analytics': {
+    #     'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+    #     'LOCATION': 'redis://127.0.0.1:6379/1',
+    # },
+}
+
+ANALYTICS_CACHE_ALIAS = 'default'
+ANALYTICS_CACHE_TIMEOUT = 60 * 15
+# Identical analytics requests in flight share one computation; the lock
+# outlives a crashed leader by at most ANALYTICS_LOCK_TIMEOUT seconds.
+ANALYTICS_LOCK_TIMEOUT = 30
+ANALYTICS_WAIT_TIMEOUT = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -134,7 +221,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authenticate.authentication.TenantJWTAuthentication',
     ),
     'PAGE_SIZE': 10
 }
@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.http import StreamingHttpResponse
+from rest_framework import serializers
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+EXPORT_CHUNK_SIZE = 2000
+FLUSH_ROWS = 500
+
+
+class ExportSerializer(serializers.Serializer):
+    file_format = serializers.ChoiceField(choices=list(EXPORT_FORMATS), default='csv')
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    product_id = serializers.IntegerField(required=False)
+    supplier_id = serializers.IntegerField(required=False)
+
+
+class ExportContentNegotiation(DefaultContentNegotiation):
+    # Exports answer with their own content type, so an Accept header such as
+    # text/csv must not fail negotiation; it only picks how errors render.
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            return renderers[0], renderers[0].media_type
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for number, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if number % FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _json_chunks(columns, rows, array):
+    lines = []
+    if array:
+        yield '['
+    for number, row in enumerate(rows):
+        line = json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_value)
+        if array:
+            lines.append(line if number == 0 else ',' + line)
+        else:
+            lines.append(line + '\n')
+        if len(lines) == FLUSH_ROWS:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+    if array:
+        yield ']'
+
+
+def export_chunks(columns, rows, file_format):
+    if file_format == 'csv':
+        return _csv_chunks(columns, rows)
+    return _json_chunks(columns, rows, array=file_format == 'json')
+
+
+def streaming_export(filename, columns, queryset, file_format, chunk_size=EXPORT_CHUNK_SIZE):
+    # queryset is a values_list() over `columns`; rows are pulled from the
+    # database cursor chunk by chunk and written out as they arrive.
+    rows = queryset.iterator(chunk_size=chunk_size)
+    response = StreamingHttpResponse(
+        (chunk.encode() for chunk in export_chunks(columns, rows, file_format) if chunk),
+        content_type=EXPORT_FORMATS[file_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
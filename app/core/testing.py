@@ -0,0 +1,108 @@
+import itertools
+import re
+from datetime import date
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from authenticate.models import User
+from company.models import Company, Storage
+from supply.models import Product, Supplier
+
+FULL_SCAN = re.compile(r'^SCAN (\w+)(?! USING (?:COVERING )?INDEX)')
+
+_numbers = itertools.count(1)
+
+
+def create_tenant(name='tenant', products=5, stock=100):
+    user = User.objects.create_user(f'{name}@example.com', 'password', is_company_owner=True)
+    company = Company.objects.create(title=name, inn=f'{next(_numbers):012d}', owner=user)
+    user.company = company
+    user.save()
+    storage = Storage.objects.create(company=company, address='Склад')
+    Product.objects.bulk_create([
+        Product(storage=storage, title=f'{name}-product-{number}', purchase_price=10, sale_price=13, quantity=stock)
+        for number in range(products)
+    ])
+    client = APIClient()
+    client.force_authenticate(User.objects.get(pk=user.pk))
+    return user, client
+
+
+def create_sales(client, user, count, lines=2):
+    products = list(Product.objects.filter(storage=user.company.storage).values_list('id', flat=True))
+    for number in range(count):
+        client.post('/api/v1/sales/', {
+            'buyer_name': f'Покупатель {number}',
+            'product_sales': [
+                {'product_id': products[(number + line) % len(products)], 'quantity': 1} for line in range(lines)
+            ],
+        }, format='json')
+
+
+def create_supplies(client, user, count, lines=2):
+    supplier = Supplier.objects.create(company=user.company, title=f'{user.email} supplier',
+                                       inn=f'{next(_numbers):012d}')
+    products = list(Product.objects.filter(storage=user.company.storage).values_list('id', flat=True))
+    for number in range(count):
+        client.post('/api/v1/supply/', {
+            'supplier_id': supplier.id,
+            'delivery_date': date(2026, 1, number % 28 + 1).isoformat(),
+            'products': [
+                {'product_id': products[(number + line) % len(products)], 'quantity': 5, 'purchase_price': '10.00'}
+                for line in range(lines)
+            ],
+        }, format='json')
+    return supplier
+
+
+def read_response(response):
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+def query_plan(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class QueryPlanMixin:
+    # Tables that are tiny or looked up once per request are allowed to be
+    # scanned; everything tenant-scoped has to be reached through an index.
+    scan_allowed = set()
+
+    def setUp(self):
+        super().setUp()
+        # Cached analytics would answer without touching the database.
+        cache.clear()
+
+    def authenticate(self, user):
+        # A fresh instance, as authentication would load it, so related
+        # objects are fetched (and planned) inside the request.
+        self.client.force_authenticate(User.objects.get(pk=user.pk))
+
+    def captured_queries(self, request):
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+            read_response(response)
+        self.assertLess(response.status_code, 400, read_response(response))
+        return [query['sql'] for query in context.captured_queries]
+
+    def full_scans(self, sql):
+        scans = []
+        for detail in query_plan(sql):
+            match = FULL_SCAN.match(detail)
+            if match and match.group(1) not in self.scan_allowed:
+                scans.append(detail)
+        return scans
+
+    def assertNoFullScans(self, request):
+        selects = [sql for sql in self.captured_queries(request) if sql.lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects)
+        for sql in selects:
+            scans = self.full_scans(sql)
+            self.assertFalse(scans, f'{scans} in {sql}')
@@ -6,6 +6,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
 )
 from .settings import BASE_API_V1_PREFIX
+from monitoring.views import metrics_view
 
 from drf_spectacular.views import(
     SpectacularAPIView,
@@ -16,6 +17,7 @@ from drf_spectacular.views import(
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path(f'{BASE_API_V1_PREFIX}/schema/', SpectacularAPIView.as_view(), name='schema'),
     path (f'{BASE_API_V1_PREFIX}/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'),name='schema-swagger-ui'),
     path(f'{BASE_API_V1_PREFIX}/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='schema-redoc'),
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+class MonitoringConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'monitoring'
+
+    def ready(self):
+        if getattr(settings, 'SLOW_QUERY_LOG_ENABLED', False):
+            from .slowqueries import install_query_log
+            connection_created.connect(install_query_log, dispatch_uid='monitoring.slowqueries')
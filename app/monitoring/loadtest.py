@@ -0,0 +1,296 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
+from django.db.models import Max
+from django.test import Client
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authenticate.models import User
+from company.models import Company, Storage
+from sale.models import Sale, ProductSale
+from sale.rollups import rebuild_rollups
+from supply.models import Supplier, Supply, SupplyProduct, Product
+from .slowqueries import percentile
+
+SEED_PASSWORD = 'password'
+# Product popularity follows Zipf's law: a few products of every storage
+# get most of the sales, as they do in real shops.
+ZIPF_EXPONENT = 1.1
+# Relative sales per month (January first) and per weekday (Monday first).
+MONTH_WEIGHTS = (0.8, 0.75, 0.9, 0.95, 1.0, 0.9, 0.85, 0.85, 1.0, 1.05, 1.25, 1.7)
+WEEKDAY_WEIGHTS = (0.9, 0.9, 0.95, 1.0, 1.15, 1.35, 1.2)
+QUANTITY_WEIGHTS = (60, 22, 10, 5, 3)
+TOKEN_LIFETIME = timedelta(hours=12)
+
+API = f'/{settings.BASE_API_V1_PREFIX}'
+ENDPOINTS = {
+    'company': f'{API}/company/',
+    'storage': f'{API}/storage/detail/',
+    'employees': f'{API}/employee/',
+    'products': f'{API}/products/',
+    'suppliers': f'{API}/suppliers/',
+    'supplies': f'{API}/supplies/',
+    'sales': f'{API}/sales/get/',
+    'sales-by-amount': f'{API}/sales/get/?ordering=-total_amount',
+    'sales-count': f'{API}/sales/get/?count=true',
+    'profit': f'{API}/sales/analytics/profit?period=year',
+    'profit-by-month': f'{API}/sales/analytics/profit?period=year&group_by=month',
+    'top-products': f'{API}/sales/analytics/top-products/?period=year',
+    'sales-export': f'{API}/sales/export/?file_format=ndjson&start_date={date.today() - timedelta(days=7)}',
+}
+
+
+class WeightedChoice:
+    def __init__(self, values, weights, rng):
+        self.values = values
+        self.cumulative = list(accumulate(weights))
+        self.rng = rng
+
+    def __call__(self):
+        return self.values[bisect(self.cumulative, self.rng.random() * self.cumulative[-1])]
+
+
+def seasonal_dates(days, rng):
+    today = date.today()
+    dates = [today - timedelta(days=offset) for offset in range(days)]
+    weights = [MONTH_WEIGHTS[day.month - 1] * WEEKDAY_WEIGHTS[day.weekday()] for day in dates]
+    return WeightedChoice(dates, weights, rng)
+
+
+def _next_number(model):
+    # Seeded rows never get an id below their number and ids are not reused,
+    # so this stays clear of earlier runs after deletions, unlike a count.
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+def _create_tenants(companies, prefix):
+    # Owners outlive their companies, so users carry the numbering of both.
+    start = _next_number(User)
+    numbers = range(start, start + companies)
+    password = make_password(SEED_PASSWORD)
+    owners = User.objects.bulk_create([
+        User(email=f'{prefix}{number}@example.com', password=password, is_company_owner=True) for number in numbers
+    ])
+    tenants = Company.objects.bulk_create([
+        Company(title=f'{prefix} {number}', inn=f'9{number:011d}', owner=owner)
+        for number, owner in zip(numbers, owners)
+    ])
+    for owner, company in zip(owners, tenants):
+        owner.company = company
+    User.objects.bulk_update(owners, ['company'])
+    Storage.objects.bulk_create([Storage(company=company, address=f'Склад {company.title}') for company in tenants])
+    return owners, tenants
+
+
+def _create_products(company, count, rng):
+    products = []
+    for number in range(count):
+        purchase_price = Decimal(rng.randint(50, 50000)) / 10
+        markup = Decimal(rng.randint(110, 180)) / 100
+        products.append(Product(
+            storage=company.storage, title=f'{company.title} товар {number + 1}',
+            purchase_price=purchase_price, sale_price=(purchase_price * markup).quantize(Decimal('0.01')),
+            quantity=rng.randint(0, 2000),
+        ))
+    return Product.objects.bulk_create(products)
+
+
+def _create_supplies(company, suppliers, supplies, lines, pick_product, pick_date, rng):
+    start = _next_number(Supplier)
+    created = Supplier.objects.bulk_create([
+        Supplier(company=company, title=f'{company.title} поставщик {number}', inn=f'8{number:011d}')
+        for number in range(start, start + suppliers)
+    ])
+    rows = Supply.objects.bulk_create([
+        Supply(supplier=rng.choice(created), delivery_date=pick_date()) for _ in range(supplies)
+    ])
+    supply_products = []
+    for supply in rows:
+        for product in {pick_product() for _ in range(rng.randint(1, lines))}:
+            supply_products.append(SupplyProduct(supply=supply, product=product, quantity=rng.randint(10, 500)))
+    SupplyProduct.objects.bulk_create(supply_products, batch_size=5000)
+    return len(rows)
+
+
+def _create_sales(company, sales, lines, pick_product, pick_date, rng, batch_size):
+    pick_quantity = WeightedChoice(range(1, len(QUANTITY_WEIGHTS) + 1), QUANTITY_WEIGHTS, rng)
+    created = 0
+    while created < sales:
+        size = min(batch_size, sales - created)
+        baskets = []
+        rows = []
+        for number in range(created, created + size):
+            basket = {}
+            for _ in range(rng.randint(1, lines)):
+                product = pick_product()
+                basket[product] = basket.get(product, 0) + pick_quantity()
+            baskets.append(basket)
+            rows.append(Sale(
+                company=company, buyer_name=f'Покупатель {number % 5000 + 1}', sale_date=pick_date(),
+                total_amount=sum(product.sale_price * quantity for product, quantity in basket.items()),
+                total_cost=sum(product.purchase_price * quantity for product, quantity in basket.items()),
+                items_count=sum(basket.values()),
+            ))
+        with transaction.atomic():
+            Sale.objects.bulk_create(rows)
+            ProductSale.objects.bulk_create([
+                ProductSale(sale=sale, product=product, quantity=quantity,
+                            unit_price=product.sale_price, unit_cost=product.purchase_price)
+                for sale, basket in zip(rows, baskets) for product, quantity in basket.items()
+            ])
+        created += size
+        yield created
+
+
+def seed_crm(companies=1, products=200, suppliers=10, supplies=500, sales=10000, lines=4, days=365,
+             prefix='seed', seed=None, batch_size=5000, progress=None):
+    rng = random.Random(seed)
+    pick_date = seasonal_dates(days, rng)
+    with transaction.atomic():
+        owners, tenants = _create_tenants(companies, prefix)
+
+    for company in tenants:
+        company = Company.objects.select_related('storage').get(pk=company.pk)
+        catalog = _create_products(company, products, rng)
+        # Hot products are spread over the catalog rather than being its first rows.
+        popularity = rng.sample(catalog, len(catalog))
+        pick_product = WeightedChoice(popularity, [1 / rank ** ZIPF_EXPONENT for rank in range(1, len(catalog) + 1)],
+                                      rng)
+        _create_supplies(company, suppliers, supplies, lines, pick_product, pick_date, rng)
+        for created in _create_sales(company, sales, lines, pick_product, pick_date, rng, batch_size):
+            if progress:
+                progress(company, created)
+        rebuild_rollups(company.id)
+    return owners
+
+
+def access_token(user):
+    # Long runs must not start collecting 401s once the usual lifetime ends.
+    token = AccessToken.for_user(user)
+    token.set_exp(lifetime=TOKEN_LIFETIME)
+    return str(token)
+
+
+def latency_stats(durations):
+    return {
+        'mean_ms': round(sum(durations) / len(durations) * 1000, 2) if durations else None,
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(durations, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 2),
+        'max_ms': round(max(durations, default=0) * 1000, 2),
+    }
+
+
+class Transport:
+    # Sends requests through the test client in this process, or over HTTP
+    # to a running server when base_url is given. Safe to share by threads.
+    def __init__(self, base_url=None):
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.local = threading.local()
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+        self.host = hosts[0].lstrip('.') if hosts else 'localhost'
+
+    def _client(self):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(HTTP_HOST=self.host)
+        return client
+
+    def request(self, method, path, token=None, body=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        data = json.dumps(body).encode() if body is not None else None
+        if self.base_url is None:
+            response = self._client().generic(method, path, data or b'', content_type='application/json',
+                                              headers=headers)
+            # Streaming bodies are produced lazily; timing has to include them.
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            return response.status_code
+
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    def close(self):
+        # Test client requests run in the calling thread and open its own
+        # database connections.
+        if self.base_url is None:
+            connections.close_all()
+
+
+class Benchmark:
+    def __init__(self, users, base_url=None, concurrency=4):
+        self.tokens = [access_token(user) for user in users]
+        self.transport = Transport(base_url)
+        self.concurrency = concurrency
+
+    def _timed(self, path, number):
+        started = time.perf_counter()
+        try:
+            status = self.transport.request('GET', path, self.tokens[number % len(self.tokens)])
+        except Exception:
+            status = None
+        return time.perf_counter() - started, status
+
+    def _worker(self, path, numbers, results):
+        try:
+            for number in numbers:
+                results.append(self._timed(path, number))
+        finally:
+            self.transport.close()
+
+    def measure(self, path, requests, warmup=0):
+        for number in range(warmup):
+            self._timed(path, number)
+        results = []
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            started = time.perf_counter()
+            workers = [pool.submit(self._worker, path, range(offset, requests, self.concurrency), results)
+                       for offset in range(self.concurrency)]
+            for worker in workers:
+                worker.result()
+            elapsed = time.perf_counter() - started
+
+        durations = [duration for duration, _ in results]
+        return {
+            'path': path,
+            'requests': requests,
+            'errors': sum(1 for _, status in results if status is None or status >= 400),
+            'throughput_rps': round(requests / elapsed, 2) if elapsed else None,
+            **latency_stats(durations),
+        }
+
+    def run(self, endpoints, requests, warmup=0):
+        return {name: self.measure(path, requests, warmup) for name, path in endpoints.items()}
+
+
+def compare_reports(baseline, current):
+    changes = {}
+    for name, stats in current['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        changes[name] = {
+            key: round((stats[key] - previous[key]) / previous[key] * 100, 1) if previous[key] else None
+            for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')
+        }
+    return changes
@@ -0,0 +1,65 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from authenticate.models import User
+from monitoring.loadtest import ENDPOINTS, Benchmark, compare_reports
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный прогон эндпоинтов API: пропускная способность и p50/p95/p99 в формате JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', nargs='+', help='email пользователей, от имени которых идут запросы '
+                                                       '(по умолчанию владельцы компаний seed_crm)')
+        parser.add_argument('--prefix', default='seed', help='префикс email владельцев, созданных seed_crm')
+        parser.add_argument('--endpoint', action='append', choices=list(ENDPOINTS),
+                            help='прогнать только указанные эндпоинты')
+        parser.add_argument('--requests', type=int, default=200, help='запросов на эндпоинт')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--warmup', type=int, default=5, help='запросов на прогрев перед замером')
+        parser.add_argument('--url', help='адрес запущенного сервера, например http://127.0.0.1:8000; '
+                                          'по умолчанию тестовый клиент в этом процессе')
+        parser.add_argument('--output', help='записать отчет в файл')
+        parser.add_argument('--compare', help='отчет прошлого прогона для сравнения')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests и --concurrency должны быть больше нуля')
+        if options['users']:
+            users = list(User.objects.filter(email__in=options['users']))
+        else:
+            users = list(User.objects.filter(is_company_owner=True, email__startswith=options['prefix'],
+                                             company__isnull=False))
+        if not users:
+            raise CommandError('Нет пользователей для прогона, запустите seed_crm или укажите --users')
+
+        endpoints = {name: ENDPOINTS[name] for name in options['endpoint'] or ENDPOINTS}
+        benchmark = Benchmark(users, options['url'], options['concurrency'])
+        report = {
+            'commit': current_commit(),
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'target': options['url'] or 'test-client',
+            'users': len(users),
+            'concurrency': options['concurrency'],
+            'endpoints': benchmark.run(endpoints, options['requests'], options['warmup']),
+        }
+        if options['compare']:
+            with open(options['compare']) as handle:
+                report['change_percent'] = compare_reports(json.load(handle), report)
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output)
+        self.stdout.write(output)
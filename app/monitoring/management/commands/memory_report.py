@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from monitoring.memory import MEMORY_KIND, merged_memory_stats
+from monitoring.storage import clear_snapshots
+
+
+def _size(value):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(value) < 1024:
+            return f'{value:.1f} {unit}'
+        value /= 1024
+    return f'{value:.1f} GiB'
+
+
+class Command(BaseCommand):
+    help = 'Пиковое потребление памяти и основные места выделения по представлениям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', help='только указанное представление')
+        parser.add_argument('--sites', type=int, default=5, help='сколько мест выделения показать')
+        parser.add_argument('--reset', action='store_true', help='удалить накопленную статистику')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            removed = clear_snapshots(MEMORY_KIND)
+            self.stdout.write(self.style.SUCCESS(f'Удалено снимков: {removed}'))
+            return
+
+        stats = merged_memory_stats()
+        if options['view']:
+            stats = {view: entry for view, entry in stats.items() if view == options['view']}
+        if not stats:
+            self.stdout.write('Статистики памяти пока нет, проверьте MEMORY_PROFILE_VIEWS')
+            return
+
+        for view, entry in sorted(stats.items(), key=lambda item: -item[1]['peak_max']):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{view}: запросов {entry['count']}, пик {_size(entry['peak_max'])}, "
+                f"средний пик {_size(entry['peak_total'] / entry['count'])}, "
+                f"в среднем остается {_size(entry['retained_total'] / entry['count'])}"
+            ))
+            for site in entry['sites'][:options['sites']]:
+                self.stdout.write(f"   {_size(site['size']):>12}  {site['count']:>7} блоков  {site['site']}")
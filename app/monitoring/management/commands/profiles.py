@@ -0,0 +1,60 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.profiling import stored_profiles, profile_files
+
+
+class Command(BaseCommand):
+    help = 'Список и сводка сохраненных профилей запросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', help='показать отчет указанного профиля')
+        parser.add_argument('--view', help='только профили указанного представления')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--stacks', type=int, default=10, help='сколько самых частых стеков показать')
+        parser.add_argument('--clear', action='store_true', help='удалить сохраненные профили')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            removed = 0
+            for meta in stored_profiles(options['view']):
+                for path in profile_files(meta['id']).values():
+                    path.unlink(missing_ok=True)
+                removed += 1
+            self.stdout.write(self.style.SUCCESS(f'Удалено профилей: {removed}'))
+        elif options['profile_id']:
+            self.show(options['profile_id'], options['stacks'])
+        else:
+            self.summary(stored_profiles(options['view']), options['limit'])
+
+    def summary(self, profiles, limit):
+        if not profiles:
+            self.stdout.write('Сохраненных профилей нет')
+            return
+
+        by_view = defaultdict(list)
+        for meta in profiles:
+            by_view[meta['view']].append(meta['duration'])
+        for view, durations in sorted(by_view.items(), key=lambda item: -max(item[1])):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{view}: {len(durations)} профилей, среднее {sum(durations) / len(durations) * 1000:.1f} ms, '
+                f'максимум {max(durations) * 1000:.1f} ms'
+            ))
+        self.stdout.write('')
+        for meta in profiles[:limit]:
+            self.stdout.write(
+                f"{meta['id']}  {meta['method']} {meta['path']} -> {meta['status']}, "
+                f"{meta['duration'] * 1000:.1f} ms, выборок {meta['samples']}"
+            )
+
+    def show(self, profile_id, stacks):
+        files = profile_files(profile_id)
+        if not files['json'].exists():
+            raise CommandError(f'Профиль {profile_id} не найден')
+
+        self.stdout.write(files['txt'].read_text())
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Самые частые стеки ({files["collapsed"]}):'))
+        for line in files['collapsed'].read_text().splitlines()[:stacks]:
+            stack, count = line.rsplit(' ', 1)
+            self.stdout.write(f'{count:>6}  {" <- ".join(reversed(stack.split(";")[-4:]))}')
@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from company.models import Company
+from monitoring.replay import Replayer
+from monitoring.traffic import load_trace, trace_files
+
+
+class Command(BaseCommand):
+    help = ('Воспроизвести записанный трафик (TRAFFIC_CAPTURE_ENABLED) на базе, заполненной seed_crm: '
+            'задержки и доля ошибок по представлениям в формате JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='файлы трассы (по умолчанию все из каталога мониторинга)')
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='ускорение относительно записи, 0 - без пауз между запросами')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--url', help='адрес запущенного сервера, например http://127.0.0.1:8000; '
+                                          'по умолчанию тестовый клиент в этом процессе')
+        parser.add_argument('--view', action='append', help='воспроизвести только указанные представления')
+        parser.add_argument('--limit', type=int, help='воспроизвести только первые N запросов')
+        parser.add_argument('--prefix', default='seed', help='префикс email владельцев, созданных seed_crm')
+        parser.add_argument('--output', help='записать отчет в файл')
+
+    def handle(self, *args, **options):
+        if options['speed'] < 0 or options['concurrency'] < 1:
+            raise CommandError('--speed не может быть отрицательным, --concurrency должен быть больше нуля')
+        if not trace_files(options['paths']):
+            raise CommandError('Трасса не найдена, включите TRAFFIC_CAPTURE_ENABLED или укажите файлы')
+        entries = load_trace(options['paths'], options['view'])[:options['limit']]
+        if not entries:
+            raise CommandError('В трассе нет запросов для воспроизведения')
+        companies = list(Company.objects.filter(owner__email__startswith=options['prefix'])
+                         .select_related('owner').order_by('id'))
+        if not companies:
+            raise CommandError('Нет компаний для воспроизведения, запустите seed_crm или укажите --prefix')
+
+        replayer = Replayer(companies, options['url'], options['concurrency'], options['speed'])
+        report = {
+            'target': options['url'] or 'test-client',
+            'speed': options['speed'],
+            'concurrency': options['concurrency'],
+            'companies': len(companies),
+            **replayer.run(entries),
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output)
+        self.stdout.write(output)
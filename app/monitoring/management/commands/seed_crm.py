@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from monitoring.loadtest import SEED_PASSWORD, seed_crm
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу правдоподобными тестовыми данными: компании, склады, поставщики, товары, поставки и продажи'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=1)
+        parser.add_argument('--products', type=int, default=200, help='товаров на компанию')
+        parser.add_argument('--suppliers', type=int, default=10, help='поставщиков на компанию')
+        parser.add_argument('--supplies', type=int, default=500, help='поставок на компанию')
+        parser.add_argument('--sales', type=int, default=10000, help='продаж на компанию')
+        parser.add_argument('--lines', type=int, default=4, help='наибольшее число товаров в продаже')
+        parser.add_argument('--days', type=int, default=365, help='за сколько последних дней создавать продажи')
+        parser.add_argument('--prefix', default='seed', help='префикс названий компаний и email владельцев')
+        parser.add_argument('--seed', type=int, help='зерно генератора для воспроизводимых данных')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        for name in ('companies', 'products', 'suppliers', 'lines', 'days', 'batch_size'):
+            if options[name] < 1:
+                raise CommandError(f'--{name.replace("_", "-")} должно быть больше нуля')
+
+        def progress(company, created):
+            self.stdout.write(f'{company.title}: продаж {created} из {options["sales"]}')
+
+        owners = seed_crm(
+            companies=options['companies'], products=options['products'], suppliers=options['suppliers'],
+            supplies=options['supplies'], sales=options['sales'], lines=options['lines'], days=options['days'],
+            prefix=options['prefix'], seed=options['seed'], batch_size=options['batch_size'], progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Создано компаний: {len(owners)}'))
+        for owner in owners:
+            self.stdout.write(f'   {owner.email} / {SEED_PASSWORD}')
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from monitoring.slowqueries import SNAPSHOT_KIND, merged_stats
+from monitoring.storage import clear_snapshots
+
+SORT_KEYS = ('total', 'p95', 'max', 'count', 'slow')
+
+
+class Command(BaseCommand):
+    help = 'Выводит самые затратные запросы по отпечаткам SQL, собранным со всех процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=SORT_KEYS, default='total')
+        parser.add_argument('--limit', type=int, default=15)
+        parser.add_argument('--view', help='только запросы указанного представления, например SaleView')
+        parser.add_argument('--plans', action='store_true', help='показать планы медленных запросов')
+        parser.add_argument('--reset', action='store_true', help='удалить накопленную статистику')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            removed = clear_snapshots(SNAPSHOT_KIND)
+            self.stdout.write(self.style.SUCCESS(f'Удалено снимков: {removed}'))
+            return
+
+        stats = merged_stats()
+        if options['view']:
+            stats = {key: entry for key, entry in stats.items() if options['view'] in entry['views']}
+        if not stats:
+            self.stdout.write('Статистики запросов пока нет')
+            return
+
+        ranked = sorted(stats.items(), key=lambda item: item[1][options['sort']], reverse=True)
+        for number, (key, entry) in enumerate(ranked[:options['limit']], 1):
+            views = ', '.join(f'{view} ({count})' for view, count in entry['views'].most_common(3))
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{number}. total {entry['total'] * 1000:.1f} ms, count {entry['count']}, "
+                f"avg {entry['total'] / entry['count'] * 1000:.2f} ms, p95 {entry['p95'] * 1000:.2f} ms, "
+                f"max {entry['max'] * 1000:.2f} ms, slow {entry['slow']}"
+            ))
+            self.stdout.write(f'   views: {views}')
+            self.stdout.write(f'   {key[:500]}')
+            if options['plans'] and entry['plan']:
+                for line in entry['plan']:
+                    self.stdout.write(f'     plan: {line}')
@@ -0,0 +1,74 @@
+import threading
+import tracemalloc
+
+from .storage import write_snapshot, read_snapshots
+
+MEMORY_KIND = 'memory'
+TOP_SITES = 10
+
+
+class MemoryTracker:
+    # tracemalloc is process wide, so one selected request is traced at a
+    # time and concurrent ones go through untraced.
+    def __init__(self, frames):
+        self.frames = frames
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def start(self):
+        if not self.lock.acquire(blocking=False):
+            return None
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start(self.frames)
+        tracemalloc.reset_peak()
+        return tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[0]
+
+    def finish(self, view_name, state):
+        before, baseline = state
+        try:
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            if self.started_tracing:
+                tracemalloc.stop()
+        finally:
+            self.lock.release()
+
+        sites = [
+            {
+                'site': str(diff.traceback[0]) if diff.traceback else '?',
+                'size': diff.size_diff,
+                'count': diff.count_diff,
+            }
+            for diff in after.compare_to(before, 'lineno')[:TOP_SITES]
+        ]
+        self.record(view_name, peak - baseline, current - baseline, sites)
+
+    def record(self, view_name, peak, retained, sites):
+        entry = self.stats.setdefault(view_name, {
+            'count': 0, 'peak_total': 0, 'peak_max': 0, 'retained_total': 0, 'last_peak': 0, 'sites': [],
+        })
+        entry['count'] += 1
+        entry['peak_total'] += peak
+        entry['retained_total'] += retained
+        entry['last_peak'] = peak
+        if peak >= entry['peak_max']:
+            entry['peak_max'] = peak
+            entry['sites'] = sites
+        write_snapshot(MEMORY_KIND, self.stats)
+
+
+def merged_memory_stats():
+    merged = {}
+    for snapshot in read_snapshots(MEMORY_KIND):
+        for view_name, entry in snapshot.items():
+            total = merged.setdefault(view_name, {
+                'count': 0, 'peak_total': 0, 'peak_max': 0, 'retained_total': 0, 'sites': [],
+            })
+            total['count'] += entry['count']
+            total['peak_total'] += entry['peak_total']
+            total['retained_total'] += entry['retained_total']
+            if entry['peak_max'] >= total['peak_max']:
+                total['peak_max'] = entry['peak_max']
+                total['sites'] = entry['sites']
+    return merged
@@ -0,0 +1,133 @@
+import atexit
+import threading
+from time import monotonic
+
+from django.conf import settings
+
+from .storage import collect_snapshots, write_snapshot
+
+METRICS_KIND = 'metrics'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_INTERVAL = 5
+
+
+class Metrics:
+    # Plain dict counters under one lock; each worker writes them to its own
+    # file now and then and /metrics adds all files together.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.exit_hook = None
+        self.requests = {}
+        self.errors = {}
+        self.queries = {}
+        self.durations = {}
+        self.flushed_at = monotonic()
+
+    def observe(self, view, method, status_code, duration, queries):
+        status = f'{status_code // 100}xx'
+        with self.lock:
+            key = (view, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if status_code >= 500:
+                self.errors[(view, method)] = self.errors.get((view, method), 0) + 1
+            self.queries[(view,)] = self.queries.get((view,), 0) + queries
+
+            histogram = self.durations.get((view,))
+            if histogram is None:
+                histogram = self.durations[(view,)] = {'buckets': [0] * len(DURATION_BUCKETS), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += duration
+            histogram['count'] += 1
+            due = monotonic() - self.flushed_at >= FLUSH_INTERVAL
+            if self.exit_hook is None:
+                # Requests since the last flush would be lost when the worker exits.
+                self.exit_hook = atexit.register(self.flush)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.flushed_at = monotonic()
+            data = {
+                'requests': [[*key, value] for key, value in self.requests.items()],
+                'errors': [[*key, value] for key, value in self.errors.items()],
+                'queries': [[*key, value] for key, value in self.queries.items()],
+                'durations': [[*key, value] for key, value in self.durations.items()],
+            }
+        write_snapshot(METRICS_KIND, data)
+
+
+metrics = Metrics()
+
+
+def _merge_counters(snapshots, name):
+    merged = {}
+    for snapshot in snapshots:
+        for *labels, value in snapshot.get(name, []):
+            merged[tuple(labels)] = merged.get(tuple(labels), 0) + value
+    return merged
+
+
+def _merge_histograms(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for *labels, value in snapshot.get('durations', []):
+            histogram = merged.setdefault(tuple(labels), {'buckets': [0] * len(DURATION_BUCKETS), 'sum': 0.0,
+                                                           'count': 0})
+            histogram['buckets'] = [total + count for total, count in zip(histogram['buckets'], value['buckets'])]
+            histogram['sum'] += value['sum']
+            histogram['count'] += value['count']
+    return merged
+
+
+def _snapshot(snapshots):
+    histograms = _merge_histograms(snapshots)
+    data = {name: [[*labels, value] for labels, value in _merge_counters(snapshots, name).items()]
+            for name in ('requests', 'errors', 'queries')}
+    data['durations'] = [[*labels, value] for labels, value in histograms.items()]
+    return data
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    # With collection off this worker has nothing to add, only files left
+    # by earlier runs are reported.
+    if getattr(settings, 'METRICS_ENABLED', False):
+        metrics.flush()
+    # Counters must never go down, so exited workers are kept in the base.
+    snapshots = collect_snapshots(METRICS_KIND, _snapshot)
+    lines = []
+
+    counters = (
+        ('crm_http_requests_total', 'requests', ('view', 'method', 'status'), 'HTTP requests by view.'),
+        ('crm_http_request_errors_total', 'errors', ('view', 'method'), 'HTTP requests answered with 5xx.'),
+        ('crm_db_queries_total', 'queries', ('view',), 'Database queries run by requests.'),
+    )
+    for metric, name, label_names, help_text in counters:
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+        for labels, value in sorted(_merge_counters(snapshots, name).items()):
+            lines.append(f'{metric}{_labels(label_names, labels)} {value}')
+
+    metric = 'crm_http_request_duration_seconds'
+    lines += [f'# HELP {metric} Time spent answering requests.', f'# TYPE {metric} histogram']
+    for labels, histogram in sorted(_merge_histograms(snapshots).items()):
+        for bound, count in zip(DURATION_BUCKETS, histogram['buckets']):
+            lines.append(f'{metric}_bucket{_labels(("view",), labels, [("le", bound)])} {count}')
+        lines.append(f'{metric}_bucket{_labels(("view",), labels, [("le", "+Inf")])} {histogram["count"]}')
+        lines.append(f'{metric}_sum{_labels(("view",), labels)} {_number(histogram["sum"])}')
+        lines.append(f'{metric}_count{_labels(("view",), labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,244 @@
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from time import perf_counter, time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils.crypto import constant_time_compare
+
+from .memory import MemoryTracker
+from .metrics import metrics
+from .profiling import RateLimiter, RequestProfile
+from .traffic import TrafficRecorder
+
+logger = logging.getLogger('monitoring')
+
+_current = ContextVar('request_metrics', default=None)
+current_view = ContextVar('current_view', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.view_time = None
+        self.render_time = 0.0
+        self.statements = Counter()
+        self.view_started = None
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+
+def current_metrics():
+    return _current.get()
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'view_class', None) or getattr(match.func, 'cls', None)
+    if view_class is not None:
+        return view_class.__name__
+    return getattr(match.func, '__name__', None) or match.view_name
+
+
+class ViewNameMiddleware:
+    # Makes the resolved view name available to code that has no request,
+    # such as database execute wrappers.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_view.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            current_view.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        current_view.set(get_view_name(request))
+
+
+def _milliseconds(seconds):
+    return round(seconds * 1000, 1)
+
+
+class RequestTimingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_TIMING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.query_budget = getattr(settings, 'REQUEST_QUERY_BUDGET', None)
+        self.duplicate_threshold = getattr(settings, 'REQUEST_DUPLICATE_QUERY_THRESHOLD', None)
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = perf_counter()
+        try:
+            with connection.execute_wrapper(metrics):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = perf_counter() - start
+        if metrics.view_time is None and metrics.view_started is not None:
+            metrics.view_time = perf_counter() - metrics.view_started
+
+        response['Server-Timing'] = ', '.join([
+            f'db;desc="{metrics.queries} queries";dur={_milliseconds(metrics.db_time)}',
+            f'serializer;dur={_milliseconds(metrics.serializer_time)}',
+            f'view;dur={_milliseconds(metrics.view_time or 0.0)}',
+            f'render;dur={_milliseconds(metrics.render_time)}',
+            f'total;dur={_milliseconds(total)}',
+        ])
+        response['X-Query-Count'] = str(metrics.queries)
+        self.check_queries(request, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.view_started = perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that apart.
+        metrics = _current.get()
+        if metrics is None:
+            return response
+        if metrics.view_started is not None:
+            metrics.view_time = perf_counter() - metrics.view_started
+
+        render = response.render
+
+        def timed_render():
+            start = perf_counter()
+            try:
+                return render()
+            finally:
+                metrics.render_time += perf_counter() - start
+
+        response.render = timed_render
+        return response
+
+    def check_queries(self, request, metrics):
+        view_name = get_view_name(request)
+        if self.query_budget is not None and metrics.queries > self.query_budget:
+            logger.warning(
+                '%s %s (%s) ran %d queries, budget is %d',
+                request.method, request.path, view_name, metrics.queries, self.query_budget,
+            )
+        if self.duplicate_threshold and metrics.statements:
+            sql, repeats = metrics.statements.most_common(1)[0]
+            if repeats >= self.duplicate_threshold:
+                logger.warning(
+                    '%s %s (%s) repeated the same query %d times, possible N+1: %s',
+                    request.method, request.path, view_name, repeats, sql[:300],
+                )
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.token = getattr(settings, 'PROFILING_TOKEN', None)
+        if not self.token:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.limiter = RateLimiter(getattr(settings, 'PROFILING_MAX_PER_MINUTE', 5))
+        self.interval = getattr(settings, 'PROFILING_SAMPLE_INTERVAL_MS', 5) / 1000
+        # cProfile can only be active once per interpreter.
+        self.busy = threading.Lock()
+
+    def requested(self, request):
+        token = request.headers.get('X-Profile') or request.GET.get('profile')
+        return bool(token) and constant_time_compare(token, self.token)
+
+    def __call__(self, request):
+        if not self.requested(request) or not self.busy.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            if not self.limiter.acquire():
+                return self.get_response(request)
+            with RequestProfile(self.interval) as profile:
+                response = self.get_response(request)
+        finally:
+            self.busy.release()
+        response['X-Profile-Id'] = profile.save(get_view_name(request), request, response.status_code)
+        return response
+
+
+class MemoryProfilingMiddleware:
+    def __init__(self, get_response):
+        self.views = set(getattr(settings, 'MEMORY_PROFILE_VIEWS', ()))
+        if not self.views:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.tracker = MemoryTracker(getattr(settings, 'MEMORY_PROFILE_FRAMES', 10))
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        state = getattr(request, '_memory_profile', None)
+        if state is not None:
+            self.tracker.finish(get_view_name(request), state)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        if get_view_name(request) in self.views or match.view_name in self.views:
+            request._memory_profile = self.tracker.start()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        metrics.observe(get_view_name(request), request.method, response.status_code,
+                        perf_counter() - start, counter.count)
+        return response
+
+
+class TrafficCaptureMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'TRAFFIC_CAPTURE_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = f'/{settings.BASE_API_V1_PREFIX}/'
+        self.recorder = TrafficRecorder(getattr(settings, 'TRAFFIC_CAPTURE_FILE', None),
+                                        getattr(settings, 'TRAFFIC_CAPTURE_SAMPLE_RATE', 1.0))
+
+    def __call__(self, request):
+        if not request.path.startswith(self.prefix) or not self.recorder.sampled():
+            return self.get_response(request)
+        body = self.recorder.body(request)
+        started = time()
+        start = perf_counter()
+        response = self.get_response(request)
+        self.recorder.record(request, response, get_view_name(request), body, started, perf_counter() - start)
+        return response
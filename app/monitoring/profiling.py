@@ -0,0 +1,130 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from .storage import monitoring_dir
+
+PROFILES_KIND = 'profiles'
+REPORT_LINES = 60
+
+
+class RateLimiter:
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.started = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        now = time.monotonic()
+        with self.lock:
+            while self.started and now - self.started[0] >= 60:
+                self.started.popleft()
+            if len(self.started) >= self.per_minute:
+                return False
+            self.started.append(now)
+            return True
+
+
+def _frame_label(code):
+    filename = code.co_filename
+    for path in sorted(sys.path, key=len, reverse=True):
+        if path and filename.startswith(path):
+            filename = filename[len(path):].lstrip(os.sep)
+            break
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class StackSampler(threading.Thread):
+    # Samples one thread's stack from the outside, so the profiled code does
+    # not pay for tracing; the counts are flamegraph "collapsed" stacks.
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    def __init__(self, interval):
+        self.profiler = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(), interval)
+
+    def __enter__(self):
+        # The sampler only runs when the request thread drops the GIL; a short
+        # switch interval keeps pure-Python stretches from hiding in samples.
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, self.sampler.interval / 2))
+        self.started = time.perf_counter()
+        self.sampler.start()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.sampler.stop()
+        sys.setswitchinterval(self.switch_interval)
+        self.duration = time.perf_counter() - self.started
+
+    def report(self):
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(REPORT_LINES)
+        return stream.getvalue()
+
+    def save(self, view_name, request, status_code):
+        profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{view_name}-{os.getpid()}-{threading.get_ident() % 10000}'
+        directory = monitoring_dir(PROFILES_KIND)
+        (directory / f'{profile_id}.collapsed').write_text(self.sampler.collapsed())
+        (directory / f'{profile_id}.txt').write_text(self.report())
+        (directory / f'{profile_id}.json').write_text(json.dumps({
+            'id': profile_id,
+            'view': view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': status_code,
+            'duration': self.duration,
+            'samples': sum(self.sampler.stacks.values()),
+            'created': time.time(),
+        }))
+        return profile_id
+
+
+def stored_profiles(view=None):
+    profiles = []
+    for path in monitoring_dir(PROFILES_KIND).glob('*.json'):
+        try:
+            meta = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        if view is None or meta['view'] == view:
+            profiles.append(meta)
+    return sorted(profiles, key=lambda meta: meta['created'], reverse=True)
+
+
+def profile_files(profile_id):
+    directory = monitoring_dir(PROFILES_KIND)
+    return {suffix: directory / f'{profile_id}.{suffix}' for suffix in ('json', 'txt', 'collapsed')}
@@ -0,0 +1,238 @@
+import queue
+import re
+import threading
+import time
+from itertools import count
+from urllib.parse import urlencode
+
+from authenticate.models import User
+from company.models import Company
+from sale.models import Sale
+from supply.models import Product, Supplier
+from .loadtest import SEED_PASSWORD, Transport, access_token, latency_stats
+from .traffic import MASK
+
+# Ids in bodies and query strings, and in the URLs of these views, point to
+# rows of the recorded database and are remapped on replay.
+ID_FIELDS = {'product_id': 'product', 'supplier_id': 'supplier'}
+PATH_IDS = {
+    'ProductIdView': 'product',
+    'SuplierIdView': 'supplier',
+    'SaleIdView': 'sale',
+    'SalePatchView': 'sale',
+    'CompanyIdViewSet': 'company',
+    'EmployeeViewSetDelete': 'employee',
+}
+CREDENTIAL_VIEWS = {'LoginView', 'TokenObtainPairView'}
+ROUTE_PARAMETER = re.compile(r'<(?:\w+:)?(\w+)>')
+
+
+class IdMapper:
+    # Every recorded company is played by one seeded company and every
+    # recorded id by a row of that company, always the same one, so a trace
+    # replays identically against the same database.
+    def __init__(self, companies):
+        self.companies = companies
+        self.company_for = {}
+        self.users = {}
+        self.employees_used = {}
+        self.ids = {}
+        self.ids_used = {}
+        self.pools = {}
+        self.unique = count(1)
+        # Names and INNs must not collide with earlier replays of the trace.
+        self.run_id = time.time_ns()
+
+    def company(self, key):
+        if key not in self.company_for:
+            self.company_for[key] = self.companies[len(self.company_for) % len(self.companies)]
+        return self.company_for[key]
+
+    def pool(self, company, kind):
+        if (company.id, kind) not in self.pools:
+            if kind == 'product':
+                rows = Product.objects.filter(storage__company=company)
+            elif kind == 'supplier':
+                rows = Supplier.objects.filter(company=company)
+            elif kind == 'sale':
+                rows = Sale.objects.filter(company=company)
+            elif kind == 'employee':
+                rows = User.objects.filter(company=company, is_company_owner=False)
+            else:
+                rows = Company.objects.filter(pk=company.pk)
+            self.pools[company.id, kind] = list(rows.order_by('id').values_list('id', flat=True)[:10000])
+        return self.pools[company.id, kind]
+
+    def user(self, entry):
+        if entry['user'] is None:
+            return None
+        if entry['user'] not in self.users:
+            company = self.company(entry['company'])
+            employees = self.pool(company, 'employee')
+            if entry['owner'] or not employees:
+                self.users[entry['user']] = company.owner
+            else:
+                used = self.employees_used.get(company.id, 0)
+                self.employees_used[company.id] = used + 1
+                self.users[entry['user']] = User.objects.get(pk=employees[used % len(employees)])
+        return self.users[entry['user']]
+
+    def id(self, company, kind, value):
+        if company is None:
+            return value
+        key = (company.id, kind, value)
+        if key not in self.ids:
+            pool = self.pool(company, kind)
+            used = self.ids_used.get((company.id, kind), 0)
+            self.ids_used[company.id, kind] = used + 1
+            self.ids[key] = pool[used % len(pool)] if pool else value
+        return self.ids[key]
+
+    def fill(self, key, view):
+        number = next(self.unique)
+        if key in ('password', 'confirm_password'):
+            return SEED_PASSWORD
+        if key == 'email':
+            if view in CREDENTIAL_VIEWS:
+                return self.companies[number % len(self.companies)].owner.email
+            return f'replay-{self.run_id}-{number}@example.com'
+        if key == 'inn':
+            return f'{(self.run_id + number) % 10 ** 12:012d}'
+        return f'replay {self.run_id}-{number}'
+
+    def rebuild(self, value, company, view, key=None):
+        if isinstance(value, dict):
+            if MASK in value:
+                return self.fill(key, view)
+            return {name: self.rebuild(item, company, view, name) for name, item in value.items()}
+        if isinstance(value, list):
+            return [self.rebuild(item, company, view, key) for item in value]
+        if key in ID_FIELDS and value is not None:
+            return self.id(company, ID_FIELDS[key], int(value))
+        return value
+
+
+def replay_request(mapper, entry):
+    # Returns (method, path, user, body) or None for requests that cannot be
+    # replayed, such as file uploads.
+    body = entry['body']
+    if isinstance(body, dict) and MASK in body and 'content_type' in body:
+        return None
+    user = mapper.user(entry)
+    company = mapper.company(entry['company']) if entry['company'] else None
+    kwargs = dict(entry['kwargs'])
+    if entry['view'] in PATH_IDS and company is not None:
+        kwargs = {name: mapper.id(company, PATH_IDS[entry['view']], int(value)) for name, value in kwargs.items()}
+    path = '/' + ROUTE_PARAMETER.sub(lambda match: str(kwargs[match.group(1)]), entry['route'])
+    query = mapper.rebuild(entry['query'], company, entry['view'])
+    if query:
+        path += '?' + urlencode(query)
+    return entry['method'], path, user, mapper.rebuild(body, company, entry['view'])
+
+
+class Replayer:
+    def __init__(self, companies, base_url=None, concurrency=4, speed=1.0):
+        self.mapper = IdMapper(companies)
+        self.transport = Transport(base_url)
+        self.concurrency = concurrency
+        self.speed = speed
+        self.tokens = {}
+        self.results = []
+        self.lock = threading.Lock()
+
+    def token(self, user):
+        if user is None:
+            return None
+        if user.pk not in self.tokens:
+            self.tokens[user.pk] = access_token(user)
+        return self.tokens[user.pk]
+
+    def send(self, entry, request, due):
+        method, path, user, body = request
+        started = time.perf_counter()
+        try:
+            status = self.transport.request(method, path, self.token(user), body)
+        except Exception:
+            status = None
+        finished = time.perf_counter()
+        with self.lock:
+            self.results.append((entry, status, finished - started, max(started - due, 0)))
+
+    def _worker(self, jobs):
+        try:
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+                self.send(*job)
+        finally:
+            self.transport.close()
+
+    def run(self, entries):
+        # Requests are prepared (and ids mapped) up front in trace order, so
+        # the mapping does not depend on how the threads interleave.
+        prepared = []
+        skipped = {}
+        for entry in entries:
+            request = replay_request(self.mapper, entry)
+            if request is None:
+                skipped[entry['view']] = skipped.get(entry['view'], 0) + 1
+            else:
+                prepared.append((entry, request))
+                self.token(request[2])
+
+        jobs = queue.Queue()
+        workers = [threading.Thread(target=self._worker, args=(jobs,), daemon=True) for _ in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        started = time.perf_counter()
+        first = prepared[0][0]['ts'] if prepared else 0
+        for entry, request in prepared:
+            # Speed 0 sends everything as fast as the workers take it.
+            due = started + (entry['ts'] - first) / self.speed if self.speed else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            jobs.put((entry, request, due))
+        for _ in workers:
+            jobs.put(None)
+        for worker in workers:
+            worker.join()
+        return self.report(time.perf_counter() - started, skipped)
+
+    def report(self, elapsed, skipped):
+        views = {}
+        for entry, status, duration, lag in self.results:
+            stats = views.setdefault(entry['view'], {'durations': [], 'recorded': [], 'lags': [], 'statuses': {},
+                                                     'errors': 0, 'changed': 0})
+            stats['durations'].append(duration)
+            stats['recorded'].append(entry['duration_ms'] / 1000)
+            stats['lags'].append(lag)
+            label = str(status) if status is not None else 'exception'
+            stats['statuses'][label] = stats['statuses'].get(label, 0) + 1
+            if status is None or status >= 500:
+                stats['errors'] += 1
+            if status is None or status // 100 != entry['status'] // 100:
+                stats['changed'] += 1
+
+        report = {}
+        for view, stats in sorted(views.items()):
+            requests = len(stats['durations'])
+            report[view] = {
+                'requests': requests,
+                'error_rate': round(stats['errors'] / requests, 4),
+                'status_changed': stats['changed'],
+                'statuses': stats['statuses'],
+                **latency_stats(stats['durations']),
+                'recorded': latency_stats(stats['recorded']),
+                'max_lag_ms': round(max(stats['lags']) * 1000, 2),
+            }
+        total = len(self.results)
+        return {
+            'requests': total,
+            'skipped': skipped,
+            'elapsed_s': round(elapsed, 2),
+            'throughput_rps': round(total / elapsed, 2) if elapsed else None,
+            'error_rate': round(sum(stats['errors'] for stats in views.values()) / total, 4) if total else None,
+            'views': report,
+        }
@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+from time import perf_counter
+
+from rest_framework.serializers import ListSerializer
+
+from .middleware import current_metrics
+
+
+@contextmanager
+def serializer_timing():
+    metrics = current_metrics()
+    # Nested serializers are part of their parent's time.
+    if metrics is None or metrics.serializer_depth:
+        yield
+        return
+    metrics.serializer_depth += 1
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_time += perf_counter() - start
+        metrics.serializer_depth -= 1
+
+
+class TimedListSerializer(ListSerializer):
+    @property
+    def data(self):
+        with serializer_timing():
+            return super().data
+
+
+class TimedSerializerMixin:
+    # Serializer output is built lazily in .data, which is where querysets
+    # are evaluated and fields rendered, so that is what RequestTimingMiddleware
+    # reports as the serializer phase. many=True gets a timed list as well.
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        meta = getattr(cls, 'Meta', None)
+        if meta is None:
+            cls.Meta = meta = type('Meta', (), {})
+        if not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = TimedListSerializer
+
+    @property
+    def data(self):
+        with serializer_timing():
+            return super().data
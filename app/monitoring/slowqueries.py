@@ -0,0 +1,151 @@
+import atexit
+import re
+import threading
+from collections import Counter
+from time import monotonic, perf_counter
+
+from django.conf import settings
+
+from .middleware import current_view
+from .storage import collect_snapshots, write_snapshot
+
+SNAPSHOT_KIND = 'slowqueries'
+MAX_SAMPLES = 500
+FLUSH_INTERVAL = 10
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LISTS = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+_SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    sql = _STRINGS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _PLACEHOLDER_LISTS.sub('(...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class QueryLog:
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.flushed_at = monotonic()
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(self.local, 'explaining', False):
+            return execute(sql, params, many, context)
+
+        start = perf_counter()
+        result = execute(sql, params, many, context)
+        duration = perf_counter() - start
+        plan = None
+        if duration >= self.threshold and not many and sql.lstrip()[:6].upper() == 'SELECT':
+            plan = self.explain(context['connection'], sql, params)
+        self.record(sql, duration, plan)
+        return result
+
+    def explain(self, connection, sql, params):
+        self.local.explaining = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+                rows = cursor.fetchall()
+            if connection.vendor == 'sqlite':
+                return [row[-1] for row in rows]
+            return [' '.join(str(column) for column in row) for row in rows]
+        except Exception:
+            return None
+        finally:
+            self.local.explaining = False
+
+    def record(self, sql, duration, plan):
+        key = fingerprint(sql)
+        view = current_view.get() or 'no view'
+        with self.lock:
+            entry = self.stats.get(key)
+            if entry is None:
+                entry = self.stats[key] = {
+                    'count': 0, 'total': 0.0, 'max': 0.0, 'slow': 0,
+                    'samples': [], 'views': Counter(), 'sql': sql, 'plan': None,
+                }
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['views'][view] += 1
+            samples = entry['samples']
+            if len(samples) < MAX_SAMPLES:
+                samples.append(duration)
+            else:
+                samples[entry['count'] % MAX_SAMPLES] = duration
+            if duration >= self.threshold:
+                entry['slow'] += 1
+                if plan is not None:
+                    entry['plan'] = plan
+                    entry['sql'] = sql
+        if monotonic() - self.flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.flushed_at = monotonic()
+            data = {key: dict(entry, views=dict(entry['views']), samples=list(entry['samples']))
+                    for key, entry in self.stats.items()}
+        write_snapshot(SNAPSHOT_KIND, data)
+
+
+def _merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for key, entry in snapshot.items():
+            total = merged.setdefault(key, {
+                'count': 0, 'total': 0.0, 'max': 0.0, 'slow': 0,
+                'samples': [], 'views': Counter(), 'sql': entry['sql'], 'plan': None,
+            })
+            total['count'] += entry['count']
+            total['total'] += entry['total']
+            total['max'] = max(total['max'], entry['max'])
+            total['slow'] += entry['slow']
+            total['samples'] += entry['samples']
+            total['views'].update(entry['views'])
+            if entry['plan'] and not total['plan']:
+                total['plan'] = entry['plan']
+                total['sql'] = entry['sql']
+    return merged
+
+
+def _fold(snapshots):
+    # Exited workers keep as many samples per query as a running one.
+    return {key: dict(entry, views=dict(entry['views']), samples=entry['samples'][-MAX_SAMPLES:])
+            for key, entry in _merge(snapshots).items()}
+
+
+def merged_stats():
+    merged = _merge(collect_snapshots(SNAPSHOT_KIND, _fold))
+    for entry in merged.values():
+        entry['p95'] = percentile(entry.pop('samples'), 0.95)
+    return merged
+
+
+query_log = None
+_install_lock = threading.Lock()
+
+
+def install_query_log(sender, connection, **kwargs):
+    global query_log
+    with _install_lock:
+        if query_log is None:
+            query_log = QueryLog(getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100) / 1000)
+            atexit.register(query_log.flush)
+    if query_log not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_log)
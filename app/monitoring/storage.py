@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+BASE_SNAPSHOT = 'base'
+_process = None
+
+
+def monitoring_dir(kind):
+    base = getattr(settings, 'MONITORING_DIR', None) or Path(tempfile.gettempdir()) / 'crm-monitoring'
+    path = Path(base) / kind
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def process_key():
+    # The pid alone is not enough: once a worker exits the next one may get
+    # the same pid and would overwrite its file.
+    global _process
+    pid = os.getpid()
+    if _process is None or _process[0] != pid:
+        _process = (pid, time.time_ns())
+    return f'{pid}-{_process[1]}'
+
+
+def write_snapshot(kind, data, name=None):
+    # Every worker process owns one file; readers merge them. The file is
+    # replaced atomically so a reader never sees a half-written snapshot.
+    path = monitoring_dir(kind) / f'{name or process_key()}.json'
+    with tempfile.NamedTemporaryFile('w', dir=path.parent, suffix='.tmp', delete=False) as handle:
+        json.dump(data, handle, default=str)
+    os.replace(handle.name, path)
+
+
+def read_snapshot(path):
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def read_snapshots(kind):
+    snapshots = []
+    for path in sorted(monitoring_dir(kind).glob('*.json')):
+        snapshot = read_snapshot(path)
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    return snapshots
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def exited_snapshots(kind):
+    """Files left by worker processes that are no longer running."""
+    if os.name != 'posix':
+        return []
+    newest, files = {}, []
+    for path in monitoring_dir(kind).glob('*.json'):
+        pid, _, started = path.stem.partition('-')
+        if not (pid.isdigit() and started.isdigit()):
+            continue
+        files.append((int(pid), int(started), path))
+        newest[int(pid)] = max(newest.get(int(pid), 0), int(started))
+    own = process_key()
+    return [path for pid, started, path in files
+            if path.stem != own and (started < newest[pid] or not _alive(pid))]
+
+
+@contextmanager
+def snapshot_lock(kind):
+    if fcntl is None:
+        yield
+        return
+    with open(monitoring_dir(kind) / '.lock', 'w') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def collect_snapshots(kind, merge):
+    # Totals of workers that exited are moved into the base snapshot, so
+    # files do not pile up and nothing is counted twice or lost. merge
+    # turns a list of snapshots into one of the same shape.
+    with snapshot_lock(kind):
+        exited = exited_snapshots(kind)
+        if exited:
+            paths = [monitoring_dir(kind) / f'{BASE_SNAPSHOT}.json', *exited]
+            snapshots = [snapshot for snapshot in map(read_snapshot, paths) if snapshot]
+            write_snapshot(kind, merge(snapshots), BASE_SNAPSHOT)
+            for path in exited:
+                path.unlink(missing_ok=True)
+        return read_snapshots(kind)
+
+
+def clear_snapshots(kind):
+    removed = 0
+    for path in monitoring_dir(kind).glob('*.json'):
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
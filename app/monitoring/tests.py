@@ -0,0 +1,378 @@
+import json
+import os
+import subprocess
+import tempfile
+from datetime import date, timedelta
+from importlib import import_module
+from pathlib import Path
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authenticate.models import User
+from company.models import Company
+from core.testing import create_tenant, read_response
+from monitoring.loadtest import seed_crm
+from monitoring.metrics import METRICS_KIND, render_metrics
+from monitoring.replay import IdMapper, replay_request
+from monitoring.slowqueries import SNAPSHOT_KIND, merged_stats
+from monitoring.storage import process_key, write_snapshot
+from sale.models import Sale, ProductSale
+from sale.rollups import rebuild_rollups
+from supply.models import Product, Supplier, Supply, SupplyProduct
+
+API = '/api/v1'
+SIZES = (10, 1000)
+# Lists are asked for their largest page so that 10 and 1,000 rows really
+# produce pages of different length.
+PAGE = '?page_size=500'
+# Request bodies keep the same size for both fixtures; only stored data grows.
+BASKET = 5
+ROUTES = (('', 'company.urls'), ('user/', 'authenticate.urls'), ('', 'supply.urls'), ('sales/', 'sale.urls'))
+
+# Queries a request may run against either fixture. The count must also be
+# the same for both sizes, so anything that grows with the data fails.
+BUDGETS = {
+    'POST user/register/': 2,
+    'POST user/login/': 1,
+    'POST user/create-company/': 5,
+    'GET user/show-company/': 1,
+    'POST company/': 6,
+    'GET company/': 1,
+    'GET companies/<int:company_id>/': 2,
+    'PATCH company/edit/': 3,
+    'DELETE company/edit/': 69,
+    'POST storage/': 2,
+    'PATCH storage/': 2,
+    'DELETE storage/': 34,
+    'GET storage/detail/': 1,
+    'GET employee/': 2,
+    'POST employee/': 3,
+    'DELETE employee/<str:employee_id>/': 3,
+    'GET products/': 2,
+    'POST products/': 2,
+    'DELETE products/': 33,
+    'GET products/export/': 2,
+    'GET product/<int:pk>/': 2,
+    'PATCH product/<int:pk>/': 3,
+    'DELETE product/<int:pk>/': 18,
+    'GET suppliers/': 2,
+    'POST suppliers/': 4,
+    'DELETE suppliers/': 30,
+    'GET supplier/<int:pk>/': 2,
+    'PATCH supplier/<int:pk>/': 4,
+    'DELETE supplier/<int:pk>/': 18,
+    'GET supplies/': 3,
+    'GET supplies/export/': 2,
+    'POST supply/': 8,
+    'POST import/<str:kind>/': 5,
+    'POST sales/': 15,
+    'DELETE sales/': 24,
+    'POST sales/batch/': 15,
+    'GET sales/get/': 3,
+    'GET sales/export/': 2,
+    'GET sales/sale/<int:id>': 3,
+    'DELETE sales/sale/<int:id>': 16,
+    'PATCH sales/patch/<int:id>': 18,
+    'GET sales/analytics/profit': 2,
+    'GET sales/analytics/top-products/': 3,
+    'GET sales/analytics/cache-stats/': 1,
+}
+# Deletes go through Django's collector, which loads the rows it removes
+# and deletes them in chunks, so these routes may grow with the data. The
+# number is how many more queries 1,000 rows may take than 10: a chunk per
+# table, never a query per row, which would add about a thousand.
+SCALING = {
+    # Cascades to the storage, products, suppliers, supplies, sales, their
+    # lines and every rollup table of the company.
+    'DELETE company/edit/': 50,
+    # Cascades to the products, and through them to sale and supply lines
+    # and product rollups; sale totals are recounted in one UPDATE.
+    'DELETE storage/': 15,
+    # The same cascade as the storage, without the storage row itself.
+    'DELETE products/': 15,
+    # Cascades to the supplier's supplies and their lines.
+    'DELETE supplier/<int:pk>/': 15,
+    # Every sale of the company together with its lines.
+    'DELETE sales/': 15,
+}
+
+
+def _basket(fixture):
+    return [{'product_id': product_id, 'quantity': 1} for product_id in fixture.products[:BASKET]]
+
+
+def _import_file(fixture):
+    rows = ''.join(f'Импорт {fixture.size}-{number},15.00,10.00,5\n' for number in range(BASKET))
+    return SimpleUploadedFile('products.csv', f'title,sale_price,purchase_price,quantity\n{rows}'.encode())
+
+
+ENDPOINTS = {
+    'POST user/register/': lambda f: APIClient().post(f'{API}/user/register/', {
+        'email': f'registered-{f.size}@example.com', 'password': 'password', 'confirm_password': 'password',
+    }, format='json'),
+    'POST user/login/': lambda f: APIClient().post(f'{API}/user/login/', {
+        'email': f.owner.email, 'password': 'password',
+    }, format='json'),
+    'POST user/create-company/': lambda f: f.client(f.newcomer).post(f'{API}/user/create-company/', {
+        'title': f'Новая {f.size}', 'inn': f'6{f.size:011d}',
+    }, format='json'),
+    'GET user/show-company/': lambda f: f.client().get(f'{API}/user/show-company/'),
+    'POST company/': lambda f: f.client(f.newcomer).post(f'{API}/company/', {
+        'title': f'Новая {f.size}', 'inn': f'6{f.size:011d}',
+    }, format='json'),
+    'GET company/': lambda f: f.client().get(f'{API}/company/'),
+    'GET companies/<int:company_id>/': lambda f: f.client().get(f'{API}/companies/{f.owner.company_id}/'),
+    'PATCH company/edit/': lambda f: f.client().patch(f'{API}/company/edit/', {'title': f'Другая {f.size}'},
+                                                      format='json'),
+    'DELETE company/edit/': lambda f: f.client().delete(f'{API}/company/edit/'),
+    'POST storage/': lambda f: f.client(f.storeless).post(f'{API}/storage/', {'address': 'Новый склад'},
+                                                          format='json'),
+    'PATCH storage/': lambda f: f.client().patch(f'{API}/storage/', {'address': 'Другой склад'}, format='json'),
+    'DELETE storage/': lambda f: f.client().delete(f'{API}/storage/'),
+    'GET storage/detail/': lambda f: f.client().get(f'{API}/storage/detail/'),
+    'GET employee/': lambda f: f.client().get(f'{API}/employee/'),
+    'POST employee/': lambda f: f.client().post(f'{API}/employee/', {'email': f.newcomer.email}, format='json'),
+    'DELETE employee/<str:employee_id>/': lambda f: f.client().delete(f'{API}/employee/{f.employee_id}/'),
+    'GET products/': lambda f: f.client().get(f'{API}/products/{PAGE}'),
+    'POST products/': lambda f: f.client().post(f'{API}/products/', {
+        'title': f'Новый товар {f.size}', 'sale_price': '15.00',
+    }, format='json'),
+    'DELETE products/': lambda f: f.client().delete(f'{API}/products/'),
+    'GET products/export/': lambda f: f.client().get(f'{API}/products/export/'),
+    'GET product/<int:pk>/': lambda f: f.client().get(f'{API}/product/{f.products[0]}/'),
+    'PATCH product/<int:pk>/': lambda f: f.client().patch(f'{API}/product/{f.products[0]}/', {'sale_price': '14.00'},
+                                                          format='json'),
+    'DELETE product/<int:pk>/': lambda f: f.client().delete(f'{API}/product/{f.products[0]}/'),
+    'GET suppliers/': lambda f: f.client().get(f'{API}/suppliers/{PAGE}'),
+    'POST suppliers/': lambda f: f.client().post(f'{API}/suppliers/', {
+        'title': f'Новый поставщик {f.size}', 'inn': f'5{f.size:011d}',
+    }, format='json'),
+    'DELETE suppliers/': lambda f: f.client().delete(f'{API}/suppliers/'),
+    'GET supplier/<int:pk>/': lambda f: f.client().get(f'{API}/supplier/{f.supplier_id}/'),
+    'PATCH supplier/<int:pk>/': lambda f: f.client().patch(f'{API}/supplier/{f.supplier_id}/', {
+        'title': f'Другой поставщик {f.size}',
+    }, format='json'),
+    'DELETE supplier/<int:pk>/': lambda f: f.client().delete(f'{API}/supplier/{f.supplier_id}/'),
+    'GET supplies/': lambda f: f.client().get(f'{API}/supplies/{PAGE}'),
+    'GET supplies/export/': lambda f: f.client().get(f'{API}/supplies/export/'),
+    'POST supply/': lambda f: f.client().post(f'{API}/supply/', {
+        'supplier_id': f.supplier_id, 'delivery_date': date.today().isoformat(),
+        'products': [dict(line, purchase_price='11.00') for line in _basket(f)],
+    }, format='json'),
+    'POST import/<str:kind>/': lambda f: f.client().post(f'{API}/import/products/', {'file': _import_file(f)},
+                                                         format='multipart'),
+    'POST sales/': lambda f: f.client().post(f'{API}/sales/', {
+        'buyer_name': 'Покупатель', 'product_sales': _basket(f),
+    }, format='json'),
+    'DELETE sales/': lambda f: f.client().delete(f'{API}/sales/'),
+    'POST sales/batch/': lambda f: f.client().post(f'{API}/sales/batch/', {
+        'sales': [{'buyer_name': 'Покупатель', 'product_sales': [line]} for line in _basket(f)],
+    }, format='json'),
+    'GET sales/get/': lambda f: f.client().get(f'{API}/sales/get/{PAGE}'),
+    'GET sales/export/': lambda f: f.client().get(f'{API}/sales/export/'),
+    'GET sales/sale/<int:id>': lambda f: f.client().get(f'{API}/sales/sale/{f.large_sale_id}'),
+    'DELETE sales/sale/<int:id>': lambda f: f.client().delete(f'{API}/sales/sale/{f.sale_id}'),
+    'PATCH sales/patch/<int:id>': lambda f: f.client().patch(f'{API}/sales/patch/{f.sale_id}', {
+        'sale_date': (date.today() - timedelta(days=40)).isoformat(),
+    }, format='json'),
+    'GET sales/analytics/profit': lambda f: f.client().get(f'{API}/sales/analytics/profit?period=month'),
+    'GET sales/analytics/top-products/': lambda f: f.client().get(f'{API}/sales/analytics/top-products/'),
+    'GET sales/analytics/cache-stats/': lambda f: f.client(f.admin).get(f'{API}/sales/analytics/cache-stats/'),
+}
+
+
+class Fixture:
+    # One tenant where every kind of child row (products, employees,
+    # suppliers, supplies, sales, lines of one sale or supply) numbers `size`.
+    def __init__(self, size):
+        self.size = size
+        name = f'budget{size}'
+        self.owner, _ = create_tenant(name, products=size, stock=10 ** 6)
+        company = self.owner.company
+        self.products = list(
+            Product.objects.filter(storage=company.storage).order_by('id').values_list('id', flat=True)
+        )
+
+        employees = User.objects.bulk_create([
+            User(email=f'{name}-employee-{number}@example.com', company=company) for number in range(size)
+        ])
+        self.employee_id = employees[0].id
+        self.newcomer = User.objects.create_user(f'{name}-newcomer@example.com', 'password')
+        self.admin = User.objects.create_user(f'{name}-admin@example.com', 'password', is_staff=True)
+        self.storeless = User.objects.create_user(f'{name}-storeless@example.com', 'password', is_company_owner=True)
+        self.storeless.company = Company.objects.create(title=f'{name} без склада', inn=f'7{size:011d}',
+                                                        owner=self.storeless)
+        self.storeless.save()
+
+        suppliers = Supplier.objects.bulk_create([
+            Supplier(company=company, title=f'{name} поставщик {number}', inn=f'8{size:05d}{number:06d}')
+            for number in range(size)
+        ])
+        self.supplier_id = suppliers[0].id
+        supplies = Supply.objects.bulk_create([
+            Supply(supplier=suppliers[0], delivery_date=date.today() - timedelta(days=number % 30))
+            for number in range(size + 1)
+        ])
+        SupplyProduct.objects.bulk_create(
+            [SupplyProduct(supply=supplies[0], product_id=product_id, quantity=5) for product_id in self.products] +
+            [SupplyProduct(supply=supply, product_id=self.products[number % size], quantity=5)
+             for number, supply in enumerate(supplies[1:])]
+        )
+
+        sales = Sale.objects.bulk_create([
+            Sale(company=company, buyer_name=f'Покупатель {number}',
+                 sale_date=date.today() - timedelta(days=number % 30), total_amount=13, total_cost=10, items_count=1)
+            for number in range(size + 1)
+        ])
+        # The large sale is read back whole; changes go to an ordinary one, as
+        # rewriting a sale's rollups is batched by its own number of lines.
+        self.large_sale_id, self.sale_id = sales[0].id, sales[1].id
+        Sale.objects.filter(id=self.large_sale_id).update(total_amount=13 * size, total_cost=10 * size,
+                                                          items_count=size)
+        ProductSale.objects.bulk_create(
+            [ProductSale(sale=sales[0], product_id=product_id, quantity=1, unit_price=13, unit_cost=10)
+             for product_id in self.products] +
+            [ProductSale(sale=sale, product_id=self.products[number % size], quantity=1, unit_price=13, unit_cost=10)
+             for number, sale in enumerate(sales[1:])]
+        )
+        rebuild_rollups(company.id)
+
+    def client(self, user=None):
+        # Real bearer tokens, so loading the user is part of every count.
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user or self.owner)}')
+        return client
+
+
+def routes():
+    keys = set()
+    for prefix, module in ROUTES:
+        for pattern in import_module(module).urlpatterns:
+            view = pattern.callback.view_class
+            for method in view.http_method_names:
+                if method not in ('head', 'options') and hasattr(view, method):
+                    keys.add(f'{method.upper()} {prefix}{pattern.pattern}')
+    return keys
+
+
+class QueryBudgetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixtures = [Fixture(size) for size in SIZES]
+
+    def count_queries(self, name, fixture):
+        cache.clear()
+        # Every request runs in a savepoint that is rolled back, so deletes
+        # and inserts do not change the data the next request sees.
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as context:
+                response = ENDPOINTS[name](fixture)
+                content = read_response(response)
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 400, f'{name}: {content[:500]}')
+        return len(context.captured_queries)
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual(routes(), set(BUDGETS))
+        self.assertEqual(set(ENDPOINTS), set(BUDGETS))
+
+    def test_query_budgets(self):
+        for name, budget in BUDGETS.items():
+            with self.subTest(name):
+                small, large = (self.count_queries(name, fixture) for fixture in self.fixtures)
+                message = f'{name}: {small} queries for {SIZES[0]} rows, {large} for {SIZES[1]}'
+                if name in SCALING:
+                    self.assertLessEqual(large - small, SCALING[name], message)
+                else:
+                    self.assertEqual(small, large, message)
+                self.assertLessEqual(large, budget, f'{name}: {large} queries, budget is {budget}')
+
+
+class TrafficCaptureTests(APITestCase):
+    def test_trace_is_sanitized_and_replays_on_other_tenant(self):
+        user, _ = create_tenant('recorded')
+        products = list(Product.objects.filter(storage__company=user.company).values_list('id', flat=True))
+        seeded, _ = create_tenant('seeded')
+        seeded_products = list(Product.objects.filter(storage__company=seeded.company).values_list('id', flat=True))
+
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as trace, \
+                override_settings(TRAFFIC_CAPTURE_ENABLED=True, TRAFFIC_CAPTURE_FILE=trace.name):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+            response = client.post(f'{API}/sales/', {
+                'buyer_name': 'Иван Петров', 'product_sales': [{'product_id': products[2], 'quantity': 1}],
+            }, format='json')
+            self.assertEqual(response.status_code, 200)
+            entry = json.loads(trace.read())
+
+        self.assertEqual(entry['view'], 'SaleView')
+        self.assertEqual(entry['body']['buyer_name'], {'$masked': 11})
+        self.assertEqual(entry['body']['product_sales'], [{'product_id': products[2], 'quantity': 1}])
+        self.assertTrue(entry['owner'])
+        self.assertNotIn(user.email, json.dumps(entry))
+
+        method, path, replay_user, body = replay_request(IdMapper([seeded.company]), entry)
+        self.assertEqual((method, path, replay_user), ('POST', f'{API}/sales/', seeded))
+        self.assertIn(body['product_sales'][0]['product_id'], seeded_products)
+        self.assertNotEqual(body['buyer_name'], 'Иван Петров')
+
+
+class SnapshotTests(SimpleTestCase):
+    def write(self, name, count):
+        write_snapshot(METRICS_KIND, {'requests': [['TestView', 'GET', '2xx', count]]}, name)
+
+    def requests_total(self):
+        line = next(line for line in render_metrics().splitlines() if 'view="TestView"' in line)
+        return int(line.rsplit(' ', 1)[1])
+
+    def test_exited_workers_are_counted_once(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(MONITORING_DIR=directory, METRICS_ENABLED=True):
+            exited = subprocess.Popen(['true'])
+            exited.wait()
+            self.write(f'{exited.pid}-1', 3)
+            # An older file of this pid belonged to a previous worker.
+            self.write(f'{os.getpid()}-1', 2)
+            self.assertEqual(self.requests_total(), 5)
+            self.assertEqual(self.requests_total(), 5)
+
+            self.write(f'{exited.pid}-2', 4)
+            self.assertEqual(self.requests_total(), 9)
+            names = {path.name for path in (Path(directory) / METRICS_KIND).glob('*.json')}
+            self.assertEqual(names, {'base.json', f'{process_key()}.json'})
+
+    def test_disabled_metrics_write_nothing(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(MONITORING_DIR=directory, METRICS_ENABLED=False):
+            self.write('base', 3)
+            self.assertEqual(self.requests_total(), 3)
+            self.assertEqual([path.name for path in (Path(directory) / METRICS_KIND).glob('*.json')], ['base.json'])
+
+    def test_slow_queries_of_exited_workers_are_folded(self):
+        entry = {'count': 2, 'total': 0.5, 'max': 0.3, 'slow': 1, 'samples': [0.2, 0.3], 'views': {'SaleView': 2},
+                 'sql': 'SELECT 1', 'plan': None}
+        with tempfile.TemporaryDirectory() as directory, override_settings(MONITORING_DIR=directory):
+            exited = subprocess.Popen(['true'])
+            exited.wait()
+            for started in (1, 2):
+                write_snapshot(SNAPSHOT_KIND, {'SELECT ?': entry}, f'{exited.pid}-{started}')
+            self.assertEqual(merged_stats()['SELECT ?']['count'], 4)
+            self.assertEqual(merged_stats()['SELECT ?']['views'], {'SaleView': 4})
+            self.assertEqual([path.name for path in (Path(directory) / SNAPSHOT_KIND).glob('*.json')], ['base.json'])
+
+
+class SeedTests(APITestCase):
+    def test_rerun_after_deletions(self):
+        first, _ = seed_crm(companies=2, products=3, suppliers=2, supplies=2, sales=3, seed=1)
+        first.owned_company.delete()
+        owners = seed_crm(companies=2, products=3, suppliers=2, supplies=2, sales=3, seed=1)
+        self.assertEqual(Company.objects.count(), 3)
+        self.assertEqual(Supplier.objects.count(), 6)
+        self.assertEqual(User.objects.filter(email__startswith='seed').count(), 4)
+        self.assertTrue(all(owner.company_id for owner in owners))
@@ -0,0 +1,125 @@
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.http import QueryDict
+
+from .storage import monitoring_dir
+
+TRAFFIC_KIND = 'traffic'
+MASK = '$masked'
+# Values of these keys are never written to the trace, only their length.
+SENSITIVE_KEYS = {'password', 'confirm_password', 'email', 'inn', 'title', 'buyer_name', 'address', 'refresh',
+                  'access', 'token', 'file'}
+# Free-form strings are masked as well unless they are one of these
+# parameters, which steer what the request does.
+PLAIN_KEYS = {'period', 'group_by', 'compare', 'cumulative', 'file_format', 'ordering', 'count', 'page_size',
+              'limit', 'all_or_nothing'}
+PLAIN_VALUE = re.compile(r'^(-?\d+(\.\d+)?|\d{4}-\d{2}-\d{2}|true|false)$')
+PARSED_TYPES = ('application/json', 'application/x-www-form-urlencoded')
+
+
+def pseudonym(kind, value):
+    if value is None:
+        return None
+    digest = hmac.new(settings.SECRET_KEY.encode(), f'{kind}:{value}'.encode(), hashlib.sha256)
+    return digest.hexdigest()[:12]
+
+
+def sanitize(value, key=None):
+    if isinstance(value, dict):
+        return {name: sanitize(item, name) for name, item in value.items()}
+    if isinstance(value, list):
+        return [sanitize(item, key) for item in value]
+    if value is None or isinstance(value, (bool, int, float)) and key not in SENSITIVE_KEYS:
+        return value
+    text = str(value)
+    if key not in SENSITIVE_KEYS and (key in PLAIN_KEYS or PLAIN_VALUE.match(text)):
+        return text
+    return {MASK: len(text)}
+
+
+def _request_body(request):
+    content_type = request.content_type or ''
+    if request.method in ('GET', 'HEAD', 'DELETE') or not request.headers.get('Content-Length'):
+        return None
+    if content_type not in PARSED_TYPES:
+        # Uploads are not kept; replay skips them.
+        return {MASK: int(request.headers['Content-Length']), 'content_type': content_type}
+    try:
+        if content_type == 'application/json':
+            return sanitize(json.loads(request.body or b'null'))
+        return sanitize(QueryDict(request.body).dict())
+    except ValueError:
+        return {MASK: len(request.body)}
+
+
+class TrafficRecorder:
+    def __init__(self, path=None, sample_rate=1.0):
+        self.path = Path(path) if path else monitoring_dir(TRAFFIC_KIND) / f'{os.getpid()}.ndjson'
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.handle = None
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def body(self, request):
+        # Read before the view: once DRF has consumed the stream it is gone.
+        return _request_body(request)
+
+    def record(self, request, response, view_name, body, started, duration):
+        match = request.resolver_match
+        # DRF puts the user it authenticated on the underlying request.
+        user = getattr(request, 'user', None)
+        authenticated = bool(user is not None and user.is_authenticated)
+        query = request.GET.dict()
+        # Cursors point into the recorded data; replay starts from page one.
+        query.pop('cursor', None)
+        entry = {
+            'ts': round(started, 3),
+            'method': request.method,
+            'view': view_name,
+            'route': match.route if match else request.path.lstrip('/'),
+            'kwargs': match.kwargs if match else {},
+            'query': sanitize(query),
+            'body': body,
+            'user': pseudonym('user', user.pk) if authenticated else None,
+            'company': pseudonym('company', user.company_id) if authenticated else None,
+            'owner': bool(authenticated and user.is_company_owner),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+        with self.lock:
+            if self.handle is None:
+                self.handle = open(self.path, 'a', encoding='utf-8')
+            self.handle.write(line)
+            self.handle.flush()
+
+
+def trace_files(paths=None):
+    if paths:
+        return [Path(path) for path in paths]
+    return sorted(monitoring_dir(TRAFFIC_KIND).glob('*.ndjson'))
+
+
+def load_trace(paths=None, views=None):
+    entries = []
+    for path in trace_files(paths):
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if not views or entry['view'] in views:
+                    entries.append(entry)
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries
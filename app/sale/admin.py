@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Sale, ProductSale
+from .models import Sale, ProductSale, DailySalesRollup
 
 
 class ProductSaleAdmin(admin.TabularInline):
@@ -10,3 +10,8 @@ class ProductSaleAdmin(admin.TabularInline):
 class SaleAdmin(admin.ModelAdmin):
     list_display = ["id", "company", "buyer_name", "sale_date"]
     inlines = [ProductSaleAdmin]
+
+
+@admin.register(DailySalesRollup)
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    list_display = ["company", "date", "revenue", "net_profit", "sale_count", "line_count"]
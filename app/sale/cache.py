@@ -0,0 +1,161 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+STATS_KEYS = {
+    'hit': 'analytics:stats:hits',
+    'miss': 'analytics:stats:misses',
+    'coalesced': 'analytics:stats:coalesced',
+}
+LOCK_POLL_INTERVAL = 0.05
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.payload = None
+        self.failed = False
+
+
+def analytics_cache():
+    return caches[getattr(settings, 'ANALYTICS_CACHE_ALIAS', 'default')]
+
+
+def _version_key(company_id):
+    return f'analytics:version:{company_id}'
+
+
+def _new_version():
+    # Versions start from the clock so a counter lost to eviction or restart
+    # never comes back with a number that old entries were stored under.
+    return time.time_ns()
+
+
+def sales_version(company_id):
+    cache = analytics_cache()
+    key = _version_key(company_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_sales_version(*company_ids):
+    def bump():
+        cache = analytics_cache()
+        for company_id in set(company_ids):
+            try:
+                cache.incr(_version_key(company_id))
+            except ValueError:
+                cache.set(_version_key(company_id), _new_version(), timeout=None)
+
+    # Readers must not see the new version before the data it stands for.
+    transaction.on_commit(bump)
+
+
+def cache_key(view_name, company_id, params):
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    return f'analytics:{view_name}:{company_id}:{sales_version(company_id)}:{digest}'
+
+
+def _count(outcome):
+    cache = analytics_cache()
+    try:
+        cache.incr(STATS_KEYS[outcome])
+    except ValueError:
+        if not cache.add(STATS_KEYS[outcome], 1, timeout=None):
+            cache.incr(STATS_KEYS[outcome])
+
+
+def _store(cache, key, compute):
+    payload = compute()
+    cache.set(key, payload, getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 300))
+    return payload
+
+
+def _compute_shared(cache, key, compute):
+    # Across processes the leader is whoever adds the lock key; the others
+    # poll for its result and compute themselves only if the leader is gone.
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, getattr(settings, 'ANALYTICS_LOCK_TIMEOUT', 30)):
+        try:
+            payload = cache.get(key)
+            if payload is None:
+                return _store(cache, key, compute), 'miss'
+            return payload, 'coalesced'
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + getattr(settings, 'ANALYTICS_WAIT_TIMEOUT', 10)
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        payload = cache.get(key)
+        if payload is not None:
+            return payload, 'coalesced'
+        if cache.get(lock_key) is None:
+            break
+    return _store(cache, key, compute), 'miss'
+
+
+def _compute_once(cache, key, compute):
+    # Within a process concurrent identical requests wait for the first one.
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if flight.done.wait(getattr(settings, 'ANALYTICS_WAIT_TIMEOUT', 10)) and not flight.failed:
+            return flight.payload, 'coalesced'
+        return _store(cache, key, compute), 'miss'
+
+    try:
+        flight.payload, outcome = _compute_shared(cache, key, compute)
+    except BaseException:
+        flight.failed = True
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+    return flight.payload, outcome
+
+
+def cached_analytics(view_name, company_id, params, compute):
+    cache = analytics_cache()
+    key = cache_key(view_name, company_id, params)
+    payload = cache.get(key)
+    if payload is not None:
+        outcome = 'hit'
+    else:
+        payload, outcome = _compute_once(cache, key, compute)
+    _count(outcome)
+    return payload, outcome
+
+
+def cache_stats():
+    values = analytics_cache().get_many(STATS_KEYS.values())
+    hits = values.get(STATS_KEYS['hit'], 0)
+    misses = values.get(STATS_KEYS['miss'], 0)
+    coalesced = values.get(STATS_KEYS['coalesced'], 0)
+    total = hits + misses + coalesced
+    return {
+        'hits': hits,
+        'misses': misses,
+        'coalesced': coalesced,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_cache_stats():
+    analytics_cache().delete_many(STATS_KEYS.values())
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from sale.services import backfill_unit_prices
+
+
+class Command(BaseCommand):
+    help = 'Заполняет цены продажи и закупки в строках продаж, созданных до их сохранения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        updated = backfill_unit_prices(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено строк продаж: {updated}'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from sale.rollups import rebuild_rollups
+from sale.services import backfill_unit_prices
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводки продаж (по дням и по товарам) по исходным продажам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='id компании, по умолчанию все компании')
+
+    def handle(self, *args, **options):
+        backfill_unit_prices()
+        days = rebuild_rollups(options['company'])
+        self.stdout.write(self.style.SUCCESS(f'Сводка пересчитана, дней: {days}'))
@@ -0,0 +1,59 @@
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+
+from authenticate.models import User
+from company.models import Company, Storage
+from supply.models import Product
+from sale.stress import stress_sales
+
+
+class Command(BaseCommand):
+    help = ('Параллельно отправляет продажи в SaleView по нескольким товарам, '
+            'измеряет пропускную способность и проверяет остатки на складе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=50, help='Количество продаж на поток')
+        parser.add_argument('--products', type=int, default=3)
+        parser.add_argument('--stock', type=int, default=200)
+        parser.add_argument('--max-quantity', type=int, default=3)
+        parser.add_argument('--keep', action='store_true', help='Не удалять тестовую компанию после прогона')
+
+    def handle(self, *args, **options):
+        suffix = uuid4().hex[:10]
+        user = User.objects.create_user(f'stress-{suffix}@example.com', uuid4().hex, is_company_owner=True)
+        company = Company.objects.create(title=f'stress-{suffix}', inn=suffix[:12], owner=user)
+        user.company = company
+        user.save()
+        storage = Storage.objects.create(company=company)
+        products = Product.objects.bulk_create([
+            Product(storage=storage, title=f'stress-{suffix}-{i}', purchase_price=10, sale_price=13,
+                    quantity=options['stock'])
+            for i in range(options['products'])
+        ])
+
+        report = stress_sales(user, [product.id for product in products], options['threads'], options['requests'],
+                              options['max_quantity'])
+
+        consistent = True
+        for product_id, quantity in sorted(report['stock'].items()):
+            expected = options['stock'] - report['sold'][product_id]
+            ok = quantity == expected and quantity >= 0
+            consistent = consistent and ok
+            self.stdout.write(
+                f'Товар {product_id}: остаток {quantity}, продано {report["sold"][product_id]}, '
+                f'ожидалось {expected} {"OK" if ok else "ОШИБКА"}'
+            )
+        self.stdout.write(
+            f'Запросов: {report["requests"]} за {report["elapsed"]:.2f} c '
+            f'({report["requests_per_second"]:.1f} req/s, {report["sales_per_second"]:.1f} продаж/с), '
+            f'продаж: {report["created"]}, отказов по остаткам: {report["rejected"]}, ошибок: {report["errors"]}'
+        )
+
+        if not options['keep']:
+            company.delete()
+            user.delete()
+
+        if not consistent:
+            raise CommandError('Остатки на складе не совпадают с проданным количеством')
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from sale.models import Sale
+from sale.services import mismatched_sales, recount_sale_totals
+
+
+class Command(BaseCommand):
+    help = 'Сверяет итоги продаж (сумма, себестоимость, количество товаров) со строками продаж'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='id компании, по умолчанию все компании')
+        parser.add_argument('--fix', action='store_true', help='пересчитать расходящиеся итоги')
+        parser.add_argument('--show', type=int, default=20, help='сколько расхождений вывести')
+
+    def handle(self, *args, **options):
+        sales = Sale.objects.all()
+        if options['company'] is not None:
+            sales = sales.filter(company_id=options['company'])
+
+        mismatched = mismatched_sales(sales)
+        ids = list(mismatched.values_list('id', flat=True))
+        for sale in mismatched.order_by('id')[:options['show']]:
+            self.stdout.write(
+                f'Продажа {sale.id}: сумма {sale.total_amount} / {sale.expected_total_amount}, '
+                f'себестоимость {sale.total_cost} / {sale.expected_total_cost}, '
+                f'товаров {sale.items_count} / {sale.expected_items_count}'
+            )
+
+        if not ids:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+        elif options['fix']:
+            fixed = recount_sale_totals(Sale.objects.filter(id__in=ids))
+            self.stdout.write(self.style.SUCCESS(f'Исправлено продаж: {fixed}'))
+        else:
+            self.stdout.write(self.style.WARNING(f'Продаж с расхождениями: {len(ids)}, запустите с --fix'))
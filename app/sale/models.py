@@ -4,6 +4,16 @@ class Sale(models.Model):
     company = models.ForeignKey("company.Company", on_delete=models.CASCADE)
     buyer_name = models.CharField(max_length=200)
     sale_date = models.DateField()
+    total_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    total_cost = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    items_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', '-total_amount'], name='sale_company_amount_idx'),
+            models.Index(fields=['company', 'sale_date', '-total_amount'], name='sale_company_date_amount_idx'),
+            models.Index(fields=['company', '-items_count'], name='sale_company_items_idx'),
+        ]
 
     def __str__(self):
         return f"Продажа {self.company.title} от {self.sale_date}"
@@ -12,6 +22,64 @@ class ProductSale(models.Model):
     product = models.ForeignKey("supply.Product", on_delete=models.CASCADE)
     sale = models.ForeignKey("Sale", on_delete=models.CASCADE, related_name='product_sales')
     quantity = models.IntegerField()
+    # Prices at the moment of sale; product prices change with every supply.
+    unit_price = models.DecimalField(max_digits=20, decimal_places=2, null=True)
+    unit_cost = models.DecimalField(max_digits=20, decimal_places=2, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sale', 'product', 'quantity', 'unit_price', 'unit_cost'],
+                         name='product_sale_covering_idx'),
+        ]
 
     def __str__(self):
         return f"Продукт {self.product.title} продажи"
+
+
+class DailySalesRollup(models.Model):
+    company = models.ForeignKey("company.Company", on_delete=models.CASCADE, related_name='daily_sales')
+    date = models.DateField()
+    revenue = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    net_profit = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    sale_count = models.IntegerField(default=0)
+    line_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'date'], name='unique_daily_sales_rollup'),
+        ]
+
+    def __str__(self):
+        return f"Продажи компании {self.company_id} за {self.date}"
+
+
+class ProductSalesTotal(models.Model):
+    company = models.ForeignKey("company.Company", on_delete=models.CASCADE, related_name='product_sales_totals')
+    product = models.ForeignKey("supply.Product", on_delete=models.CASCADE, related_name='sales_totals')
+    quantity_sold = models.IntegerField(default=0)
+    sales_count = models.IntegerField(default=0)
+    net_profit = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'product'], name='unique_product_sales_total'),
+        ]
+        indexes = [
+            models.Index(fields=['company', '-quantity_sold'], name='product_total_quantity_idx'),
+            models.Index(fields=['company', '-net_profit'], name='product_total_profit_idx'),
+        ]
+
+
+class DailyProductSales(models.Model):
+    company = models.ForeignKey("company.Company", on_delete=models.CASCADE, related_name='daily_product_sales')
+    product = models.ForeignKey("supply.Product", on_delete=models.CASCADE, related_name='daily_sales')
+    date = models.DateField()
+    quantity_sold = models.IntegerField(default=0)
+    sales_count = models.IntegerField(default=0)
+    net_profit = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'date', 'product'], name='unique_daily_product_sales'),
+        ]
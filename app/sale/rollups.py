@@ -0,0 +1,170 @@
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, When, F, Q, Value, Sum, Count
+from django.db.models.functions import Coalesce
+
+from company.models import Company
+from .cache import bump_sales_version
+from .models import Sale, ProductSale, DailySalesRollup, ProductSalesTotal, DailyProductSales
+
+ROLLUP_BATCH_SIZE = 200
+DAILY_FIELDS = ('revenue', 'cost', 'net_profit', 'sale_count', 'line_count')
+PRODUCT_FIELDS = ('quantity_sold', 'sales_count', 'net_profit')
+# Lines that predate price snapshots fall back to the current prices.
+LINE_PRICE = Coalesce('unit_price', 'product__sale_price')
+LINE_COST = Coalesce('unit_cost', 'product__purchase_price')
+
+
+def _batches(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _accumulate(model, base, rows, fields):
+    # rows are (lookup, deltas) pairs. Missing counters are inserted as zeros
+    # first, then every delta is added in SQL so concurrent writers never
+    # lose each other's increments.
+    for batch in _batches(rows, ROLLUP_BATCH_SIZE):
+        model.objects.bulk_create([model(**base, **lookup) for lookup, _ in batch], ignore_conflicts=True)
+        conditions = [(Q(**lookup), deltas) for lookup, deltas in batch]
+        model.objects.filter(**base).filter(reduce(or_, (condition for condition, _ in conditions))).update(**{
+            field: Case(
+                *[When(condition, then=F(field) + Value(deltas[field])) for condition, deltas in conditions],
+                default=F(field),
+                output_field=model._meta.get_field(field),
+            )
+            for field in fields
+        })
+
+
+def sale_lines(product_sales):
+    return [
+        {
+            'sale_date': line['sale__sale_date'],
+            'product_id': line['product_id'],
+            'quantity': line['quantity'],
+            'price': line['price'],
+            'cost': line['cost'],
+        }
+        for line in product_sales.values('sale__sale_date', 'product_id', 'quantity', price=LINE_PRICE, cost=LINE_COST)
+    ]
+
+
+def _add_product(totals, key, line, sign):
+    entry = totals.setdefault(key, {'quantity_sold': 0, 'sales_count': 0, 'net_profit': Decimal('0')})
+    entry['quantity_sold'] += sign * line['quantity']
+    entry['sales_count'] += sign
+    entry['net_profit'] += sign * line['quantity'] * (line['price'] - line['cost'])
+
+
+def record_sales(company_id, lines, sign=1, sales=()):
+    # sales are the Sale rows created (or, with sign=-1, removed) on their
+    # sale_date. They are passed explicitly: a sale may have no lines left,
+    # and lines alone cannot tell a new sale from one losing a line.
+    days = {}
+    products = {}
+    daily_products = {}
+
+    def day_of(sale_date):
+        return days.setdefault(sale_date, {'revenue': Decimal('0'), 'cost': Decimal('0'), 'sales': set(), 'lines': 0})
+
+    for sale in sales:
+        day_of(sale.sale_date)['sales'].add(sale.id)
+    for line in lines:
+        day = day_of(line['sale_date'])
+        day['revenue'] += line['quantity'] * line['price']
+        day['cost'] += line['quantity'] * line['cost']
+        day['lines'] += 1
+        _add_product(products, line['product_id'], line, sign)
+        _add_product(daily_products, (line['sale_date'], line['product_id']), line, sign)
+
+    base = {'company_id': company_id}
+    _accumulate(DailySalesRollup, base, [
+        ({'date': sale_date}, {
+            'revenue': sign * day['revenue'],
+            'cost': sign * day['cost'],
+            'net_profit': sign * (day['revenue'] - day['cost']),
+            'sale_count': sign * len(day['sales']),
+            'line_count': sign * day['lines'],
+        })
+        for sale_date, day in days.items()
+    ], DAILY_FIELDS)
+    _accumulate(ProductSalesTotal, base, [
+        ({'product_id': product_id}, deltas) for product_id, deltas in products.items()
+    ], PRODUCT_FIELDS)
+    _accumulate(DailyProductSales, base, [
+        ({'date': sale_date, 'product_id': product_id}, deltas)
+        for (sale_date, product_id), deltas in daily_products.items()
+    ], PRODUCT_FIELDS)
+    bump_sales_version(company_id)
+
+
+def clear_rollups(company_id):
+    for model in (DailySalesRollup, ProductSalesTotal, DailyProductSales):
+        model.objects.filter(company_id=company_id).delete()
+    bump_sales_version(company_id)
+
+
+def _product_rows(product_sales, *group_by):
+    return product_sales.values('sale__company_id', 'product_id', *group_by).annotate(
+        quantity_sold=Sum('quantity'),
+        sales_count=Count('id'),
+        net_profit=Sum(F('quantity') * (LINE_PRICE - LINE_COST)),
+    ).order_by()
+
+
+def rebuild_rollups(company_id=None):
+    sales = Sale.objects.all()
+    product_sales = ProductSale.objects.all()
+    if company_id is not None:
+        sales = sales.filter(company_id=company_id)
+        product_sales = product_sales.filter(sale__company_id=company_id)
+
+    days = {}
+    for row in sales.values('company_id', 'sale_date').annotate(sale_count=Count('id')).order_by():
+        days[(row['company_id'], row['sale_date'])] = DailySalesRollup(
+            company_id=row['company_id'], date=row['sale_date'], sale_count=row['sale_count'],
+        )
+    for row in product_sales.values('sale__company_id', 'sale__sale_date').annotate(
+        revenue=Sum(F('quantity') * LINE_PRICE),
+        cost=Sum(F('quantity') * LINE_COST),
+        line_count=Count('id'),
+    ).order_by():
+        day = days[(row['sale__company_id'], row['sale__sale_date'])]
+        day.revenue = row['revenue']
+        day.cost = row['cost']
+        day.net_profit = row['revenue'] - row['cost']
+        day.line_count = row['line_count']
+
+    totals = [
+        ProductSalesTotal(
+            company_id=row['sale__company_id'], product_id=row['product_id'], quantity_sold=row['quantity_sold'],
+            sales_count=row['sales_count'], net_profit=row['net_profit'],
+        )
+        for row in _product_rows(product_sales)
+    ]
+    daily_products = [
+        DailyProductSales(
+            company_id=row['sale__company_id'], product_id=row['product_id'], date=row['sale__sale_date'],
+            quantity_sold=row['quantity_sold'], sales_count=row['sales_count'], net_profit=row['net_profit'],
+        )
+        for row in _product_rows(product_sales, 'sale__sale_date')
+    ]
+
+    with transaction.atomic():
+        for model, rows in ((DailySalesRollup, days.values()), (ProductSalesTotal, totals),
+                            (DailyProductSales, daily_products)):
+            existing = model.objects.all()
+            if company_id is not None:
+                existing = existing.filter(company_id=company_id)
+            existing.delete()
+            model.objects.bulk_create(rows, batch_size=500)
+        if company_id is None:
+            bump_sales_version(*Company.objects.values_list('id', flat=True))
+        else:
+            bump_sales_version(company_id)
+    return len(days)
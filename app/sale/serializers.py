@@ -1,26 +1,41 @@
 from rest_framework import serializers
 from .models import Sale, ProductSale
 from datetime import date
+from monitoring.serializers import TimedSerializerMixin
+
+# Every bucket of a profit series is a point in the response, empty or not.
+MAX_SERIES_BUCKETS = 1000
+
+
+def bucket_count(start, end, group_by):
+    if group_by == 'week':
+        return ((end - start).days + start.weekday()) // 7 + 1
+    elif group_by == 'month':
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    elif group_by == 'year':
+        return end.year - start.year + 1
+    return (end - start).days + 1
 
 
 class ProductSaleSerializer(serializers.ModelSerializer):
-    product_id = serializers.IntegerField(source='product.id')
+    product_id = serializers.IntegerField()
 
     class Meta:
         model = ProductSale
         fields = ["product_id", "quantity"]
 
 
-class SaleSerializer(serializers.ModelSerializer):
+class SaleSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product_sales = ProductSaleSerializer(many=True)
 
     class Meta:
         model = Sale
-        fields = ["id", "company", "buyer_name", "sale_date", "product_sales"]
-        read_only_fields = ["company", "sale_date"]
+        fields = ["id", "company", "buyer_name", "sale_date", "total_amount", "total_cost", "items_count",
+                  "product_sales"]
+        read_only_fields = ["company", "sale_date", "total_amount", "total_cost", "items_count"]
 
 
-class SalePatchSerializer(serializers.ModelSerializer):
+class SalePatchSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Sale
         fields = ["buyer_name", "sale_date"]
@@ -30,6 +45,11 @@ class SalePatchSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Дата продажи не может быть в будущем")
         return value
 
+class SaleBatchSerializer(serializers.Serializer):
+    sales = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=5000)
+    all_or_nothing = serializers.BooleanField(default=False)
+
+
 class AnalyticsSerializer(serializers.Serializer):
     period = serializers.ChoiceField(
         choices=['day', 'week', 'month', 'year'],
@@ -37,4 +57,28 @@ class AnalyticsSerializer(serializers.Serializer):
     )
     start_date = serializers.DateField(required=False)
     end_date = serializers.DateField(required=False)
+    group_by = serializers.ChoiceField(choices=['day', 'week', 'month', 'year'], required=False)
+    cumulative = serializers.BooleanField(default=False)
+    compare = serializers.ChoiceField(choices=['previous', 'last_year'], required=False)
 
+    def validate(self, attrs):
+        if attrs.get('compare') and attrs.get('group_by'):
+            raise serializers.ValidationError({"compare": "Сравнение недоступно при группировке"})
+        start_date, end_date = attrs.get('start_date'), attrs.get('end_date')
+        if start_date and end_date:
+            if start_date > end_date:
+                raise serializers.ValidationError({"end_date": "Дата окончания не может быть раньше даты начала"})
+            group_by = attrs.get('group_by')
+            if group_by and bucket_count(start_date, end_date, group_by) > MAX_SERIES_BUCKETS:
+                raise serializers.ValidationError(
+                    {"group_by": f"Слишком много точек в ряду, не больше {MAX_SERIES_BUCKETS}: "
+                                 f"сократите период или выберите группировку крупнее"}
+                )
+        return attrs
+
+
+class TopProductsSerializer(TimedSerializerMixin, serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    period = serializers.ChoiceField(choices=['day', 'week', 'month', 'year'], required=False)
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
@@ -0,0 +1,256 @@
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, When, F, Q, Sum, Value, OuterRef, Subquery, PositiveIntegerField, DecimalField, \
+    IntegerField
+from django.db.models.functions import Coalesce, Round
+from rest_framework.exceptions import ValidationError
+
+from supply.models import Product
+from .models import Sale, ProductSale
+from .rollups import record_sales
+
+
+def parse_sale_items(items):
+    lines = []
+    demand = {}
+    try:
+        for item in items:
+            product_id = int(item['product_id'])
+            quantity = int(item['quantity'])
+            if quantity <= 0:
+                raise ValidationError({"detail": f'Количество товара с индексом {product_id} должно быть больше нуля'})
+            lines.append((product_id, quantity))
+            demand[product_id] = demand.get(product_id, 0) + quantity
+    except (KeyError, TypeError, ValueError):
+        raise ValidationError({"detail": 'Неверный формат данных'})
+
+    if not lines:
+        raise ValidationError({"detail": 'Не указаны товары продажи'})
+    return lines, demand
+
+
+def check_products(products, demand):
+    for product_id in demand:
+        if product_id not in products:
+            raise ValidationError({"detail": f'Товар с индексом {product_id} не найден'})
+
+
+def load_products(storage, demand):
+    products = Product.objects.filter(storage=storage).in_bulk(demand.keys())
+    check_products(products, demand)
+    return products
+
+
+def check_stock(products, demand):
+    for product_id, quantity in demand.items():
+        product = products[product_id]
+        if product.quantity < quantity:
+            raise ValidationError({
+                "detail": f'Количество продукта {product.title}(id:{product_id}) меньше указанного. '
+                          f'Максимальное количество {product.quantity}'
+            })
+
+
+def check_batch_stock(products, demand, available):
+    check_stock(products, demand)
+    # Past this point the stock would do for this sale alone; what is short
+    # was taken by the earlier sales of the same batch.
+    for product_id, quantity in demand.items():
+        if available[product_id] < quantity:
+            product = products[product_id]
+            raise ValidationError({
+                "detail": f'Количество продукта {product.title}(id:{product_id}) меньше указанного: '
+                          f'{product.quantity - available[product_id]} из {product.quantity} '
+                          f'уже заняты предыдущими продажами пакета'
+            })
+
+
+def _stock_case(demand, sign):
+    return Case(
+        *[When(id=product_id, then=F('quantity') + sign * quantity) for product_id, quantity in demand.items()],
+        default=F('quantity'),
+        output_field=PositiveIntegerField(),
+    )
+
+
+def reserve_stock(storage, demand):
+    condition = Q()
+    for product_id, quantity in demand.items():
+        condition |= Q(id=product_id, quantity__gte=quantity)
+
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(storage=storage).filter(condition).update(
+                quantity=_stock_case(demand, -1)
+            )
+            if updated != len(demand):
+                raise ValidationError({"detail": 'Товар закончился на складе, повторите продажу'})
+    except ValidationError:
+        # A concurrent sale took the stock after the in-memory check; report
+        # the product that is short now that the partial update is rolled back.
+        # A product deleted in the meantime is reported as not found.
+        check_stock(load_products(storage, demand), demand)
+        raise
+
+
+def restore_stock(product_sales):
+    demand = dict(product_sales.values_list('product_id').annotate(quantity=Sum('quantity')).order_by())
+    if demand:
+        Product.objects.filter(id__in=demand.keys()).update(quantity=_stock_case(demand, 1))
+    return demand
+
+
+def sold_line(product, sale, quantity):
+    return ProductSale(product=product, sale=sale, quantity=quantity,
+                       unit_price=product.sale_price, unit_cost=product.purchase_price)
+
+
+def backfill_unit_prices(batch_size=5000):
+    # Lines recorded before prices were snapshotted get the product's current
+    # prices, the closest value still available.
+    pending = ProductSale.objects.filter(Q(unit_price__isnull=True) | Q(unit_cost__isnull=True))
+    product = Product.objects.filter(pk=OuterRef('product_id'))
+    updated = 0
+    while True:
+        ids = list(pending.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return updated
+        updated += ProductSale.objects.filter(id__in=ids).update(
+            unit_price=Coalesce('unit_price', Subquery(product.values('sale_price')[:1])),
+            unit_cost=Coalesce('unit_cost', Subquery(product.values('purchase_price')[:1])),
+        )
+
+
+def sale_totals(lines, products):
+    totals = {'total_amount': Decimal('0'), 'total_cost': Decimal('0'), 'items_count': 0}
+    for product_id, quantity in lines:
+        totals['total_amount'] += products[product_id].sale_price * quantity
+        totals['total_cost'] += products[product_id].purchase_price * quantity
+        totals['items_count'] += quantity
+    return totals
+
+
+def expected_totals():
+    lines = ProductSale.objects.filter(sale=OuterRef('pk')).order_by().values('sale')
+    money = DecimalField(max_digits=20, decimal_places=2)
+
+    def total(expression, output_field):
+        return Coalesce(Subquery(lines.annotate(total=Sum(expression)).values('total'), output_field=output_field),
+                        Value(0), output_field=output_field)
+
+    # SQLite multiplies decimals as floats; round back to cents before comparing.
+    return {
+        'total_amount': Round(total(F('quantity') * F('unit_price'), money), 2),
+        'total_cost': Round(total(F('quantity') * F('unit_cost'), money), 2),
+        'items_count': total(F('quantity'), IntegerField()),
+    }
+
+
+def mismatched_sales(sales):
+    expected = {f'expected_{field}': value for field, value in expected_totals().items()}
+    return sales.annotate(**expected).exclude(
+        total_amount=F('expected_total_amount'),
+        total_cost=F('expected_total_cost'),
+        items_count=F('expected_items_count'),
+    )
+
+
+def recount_sale_totals(sales):
+    return sales.update(**expected_totals())
+
+
+def _recorded_lines(sale, lines, products):
+    return [
+        {
+            'sale_date': sale.sale_date,
+            'product_id': product_id,
+            'quantity': quantity,
+            'price': products[product_id].sale_price,
+            'cost': products[product_id].purchase_price,
+        }
+        for product_id, quantity in lines
+    ]
+
+
+def create_sale(company, buyer_name, items):
+    lines, demand = parse_sale_items(items)
+
+    with transaction.atomic():
+        products = load_products(company.storage, demand)
+        check_stock(products, demand)
+        sale = Sale.objects.create(company=company, buyer_name=buyer_name, sale_date=date.today(),
+                                   **sale_totals(lines, products))
+        reserve_stock(company.storage, demand)
+        ProductSale.objects.bulk_create([
+            sold_line(products[product_id], sale, quantity)
+            for product_id, quantity in lines
+        ])
+        record_sales(company.id, _recorded_lines(sale, lines, products), sales=[sale])
+    return sale
+
+
+def create_sales_batch(company, entries, all_or_nothing=False):
+    results = [None] * len(entries)
+    parsed = []
+    for index, entry in enumerate(entries):
+        try:
+            try:
+                buyer_name = str(entry['buyer_name'])
+                items = entry['product_sales']
+            except (KeyError, TypeError):
+                raise ValidationError({"detail": 'Неверный формат данных'})
+            lines, demand = parse_sale_items(items)
+        except ValidationError as exc:
+            results[index] = {'index': index, 'detail': exc.detail['detail']}
+            continue
+        parsed.append((index, buyer_name, lines, demand))
+
+    product_ids = {product_id for _, _, _, demand in parsed for product_id in demand}
+    today = date.today()
+
+    with transaction.atomic():
+        products = Product.objects.filter(storage=company.storage).in_bulk(product_ids)
+        available = {product_id: product.quantity for product_id, product in products.items()}
+        accepted = []
+        for index, buyer_name, lines, demand in parsed:
+            try:
+                check_products(products, demand)
+                check_batch_stock(products, demand, available)
+            except ValidationError as exc:
+                results[index] = {'index': index, 'detail': exc.detail['detail']}
+                continue
+            for product_id, quantity in demand.items():
+                available[product_id] -= quantity
+            accepted.append((index, buyer_name, lines, demand))
+
+        if not accepted or (all_or_nothing and len(accepted) != len(entries)):
+            for index, _, _, _ in accepted:
+                results[index] = {'index': index, 'detail': 'Продажа не проведена из-за ошибок в пакете'}
+            return results, False
+
+        total_demand = {}
+        for _, _, _, demand in accepted:
+            for product_id, quantity in demand.items():
+                total_demand[product_id] = total_demand.get(product_id, 0) + quantity
+
+        sales = Sale.objects.bulk_create([
+            Sale(company=company, buyer_name=buyer_name, sale_date=today, **sale_totals(lines, products))
+            for _, buyer_name, lines, _ in accepted
+        ])
+        reserve_stock(company.storage, total_demand)
+        ProductSale.objects.bulk_create([
+            sold_line(products[product_id], sale, quantity)
+            for sale, (_, _, lines, _) in zip(sales, accepted)
+            for product_id, quantity in lines
+        ], batch_size=500)
+        record_sales(company.id, [
+            line
+            for sale, (_, _, lines, _) in zip(sales, accepted)
+            for line in _recorded_lines(sale, lines, products)
+        ], sales=sales)
+
+    for sale, (index, _, _, _) in zip(sales, accepted):
+        results[index] = {'index': index, 'id': sale.id}
+    return results, True
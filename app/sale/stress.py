@@ -0,0 +1,59 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+from rest_framework.test import APIClient
+
+from supply.models import Product
+from .models import ProductSale
+
+
+def stress_sales(user, product_ids, threads=8, requests=50, max_quantity=3):
+    # Every thread posts sales of random subsets of the products through
+    # SaleView over its own connection, so the stock updates race.
+    hosts = [host for host in settings.ALLOWED_HOSTS if host != '*']
+    host = hosts[0].lstrip('.') if hosts else 'localhost'
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = APIClient(raise_request_exception=False, HTTP_HOST=host)
+        client.force_authenticate(user)
+        statuses = []
+        try:
+            for _ in range(requests):
+                items = [
+                    {'product_id': product_id, 'quantity': rng.randint(1, max_quantity)}
+                    for product_id in rng.sample(product_ids, rng.randint(1, len(product_ids)))
+                ]
+                response = client.post('/api/v1/sales/', {'buyer_name': 'stress', 'product_sales': items},
+                                       format='json')
+                statuses.append(response.status_code)
+        finally:
+            connection.close()
+        return statuses
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        statuses = [code for result in executor.map(worker, range(threads)) for code in result]
+    elapsed = time.perf_counter() - started
+
+    sold = dict(
+        ProductSale.objects.filter(product_id__in=product_ids)
+        .values_list('product_id').annotate(total=Sum('quantity')).order_by()
+    )
+    created = statuses.count(200)
+    rejected = statuses.count(400)
+    return {
+        'requests': len(statuses),
+        'elapsed': elapsed,
+        'requests_per_second': len(statuses) / elapsed,
+        'sales_per_second': created / elapsed,
+        'created': created,
+        'rejected': rejected,
+        'errors': len(statuses) - created - rejected,
+        'stock': dict(Product.objects.filter(id__in=product_ids).values_list('id', 'quantity')),
+        'sold': {product_id: sold.get(product_id, 0) for product_id in product_ids},
+    }
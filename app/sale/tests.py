@@ -1,3 +1,310 @@
-from django.test import TestCase
+from datetime import date, timedelta
 
-# Create your tests here.
+from django.test import TransactionTestCase
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+
+from core.testing import QueryPlanMixin, create_tenant, create_sales
+from supply.models import Product
+from .models import Sale, ProductSale, DailySalesRollup
+from .rollups import rebuild_rollups
+from .services import backfill_unit_prices, reserve_stock
+from .stress import stress_sales
+
+
+class SaleQueryPlanTests(QueryPlanMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('first', 'second'):
+            user, client = create_tenant(name, products=10)
+            create_sales(client, user, 30)
+        cls.user = user
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.user)
+
+    def test_sale_list(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/sales/get/'))
+
+    def test_sale_list_largest_today(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/sales/get/?ordering=-total_amount&sale_date=2026-01-01'))
+
+    def test_sale_detail(self):
+        sale_id = self.user.company.sale_set.values_list('id', flat=True).first()
+        self.assertNoFullScans(lambda: self.client.get(f'/api/v1/sales/sale/{sale_id}'))
+
+    def test_profit_analytics(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/sales/analytics/profit?period=year'))
+
+    def test_profit_series(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/sales/analytics/profit?period=year&group_by=month'))
+
+    def test_profit_comparison(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/sales/analytics/profit?period=month&compare=previous'))
+
+    def test_top_products(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/sales/analytics/top-products/'))
+
+    def test_top_products_for_period(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/sales/analytics/top-products/?period=month'))
+
+    def test_export(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/sales/export/?start_date=2026-01-01'))
+
+
+class DailyRollupTests(APITestCase):
+    def rollup(self, company):
+        return sorted(DailySalesRollup.objects.filter(company=company).exclude(sale_count=0, line_count=0)
+                      .values_list('date', 'revenue', 'cost', 'sale_count', 'line_count'))
+
+    def test_matches_rebuild_after_deletes_and_moves(self):
+        user, client = create_tenant('rollup', products=2)
+        create_sales(client, user, 3, lines=1)
+        first, emptied, _ = Sale.objects.filter(company=user.company).order_by('id')
+        product = Product.objects.get(productsale__sale=emptied)
+
+        self.assertEqual(client.delete(f'/api/v1/product/{product.id}/').status_code, 200)
+        self.assertEqual(client.delete(f'/api/v1/sales/sale/{emptied.id}').status_code, 200)
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        self.assertEqual(client.patch(f'/api/v1/sales/patch/{first.id}', {'sale_date': yesterday},
+                                      format='json').status_code, 200)
+
+        recorded = self.rollup(user.company)
+        rebuild_rollups(user.company.id)
+        self.assertEqual(recorded, self.rollup(user.company))
+        self.assertEqual([row[3] for row in recorded], [1, 1])
+
+    def test_rebuild_before_prices_are_backfilled(self):
+        user, client = create_tenant('legacy', products=2)
+        create_sales(client, user, 3)
+        recorded = self.rollup(user.company)
+        ProductSale.objects.update(unit_price=None, unit_cost=None)
+
+        rebuild_rollups(user.company.id)
+        self.assertEqual(self.rollup(user.company), recorded)
+        backfill_unit_prices()
+        rebuild_rollups(user.company.id)
+        self.assertEqual(self.rollup(user.company), recorded)
+
+
+class CreateSaleTests(APITestCase):
+    def setUp(self):
+        self.user, self.client = create_tenant('seller', products=2, stock=10)
+        self.first, self.second = Product.objects.filter(storage=self.user.company.storage).order_by('id')
+
+    def post(self, *lines):
+        return self.client.post('/api/v1/sales/', {'buyer_name': 'Покупатель', 'product_sales': [
+            {'product_id': product_id, 'quantity': quantity} for product_id, quantity in lines
+        ]}, format='json')
+
+    def stock(self):
+        return list(Product.objects.filter(pk__in=[self.first.pk, self.second.pk]).order_by('id')
+                    .values_list('quantity', flat=True))
+
+    def test_duplicate_lines_are_summed(self):
+        response = self.post((self.first.id, 2), (self.second.id, 1), (self.first.id, 3))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), [5, 9])
+        sale = Sale.objects.get()
+        self.assertEqual(sale.items_count, 6)
+        self.assertEqual(sale.total_amount, 6 * self.first.sale_price)
+
+        self.assertEqual(self.post((self.first.id, 3), (self.first.id, 3)).status_code, 400)
+        self.assertEqual(self.stock(), [5, 9])
+
+    def test_product_of_another_company_is_not_found(self):
+        other, _ = create_tenant('other', products=1)
+        foreign = Product.objects.get(storage=other.company.storage)
+
+        response = self.post((self.first.id, 1), (foreign.id, 1))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], f'Товар с индексом {foreign.id} не найден')
+        self.assertEqual(self.stock(), [10, 10])
+        self.assertEqual(Product.objects.get(pk=foreign.pk).quantity, foreign.quantity)
+        self.assertFalse(Sale.objects.exists())
+
+    def test_failed_line_rolls_back_the_other_lines(self):
+        response = self.post((self.first.id, 1), (self.second.id, 11))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stock(), [10, 10])
+        self.assertFalse(Sale.objects.exists())
+
+        # The same when the stock runs out between the check and the update.
+        with self.assertRaises(ValidationError):
+            reserve_stock(self.user.company.storage, {self.first.id: 1, self.second.id: 11})
+        self.assertEqual(self.stock(), [10, 10])
+
+
+class ReserveStockTests(APITestCase):
+    def test_product_deleted_before_the_update_is_not_found(self):
+        user, _ = create_tenant('reserve', products=2)
+        kept, deleted = Product.objects.filter(storage=user.company.storage).order_by('id')
+        deleted_id = deleted.id
+        deleted.delete()
+
+        with self.assertRaises(ValidationError) as raised:
+            reserve_stock(user.company.storage, {kept.id: 1, deleted_id: 1})
+        self.assertEqual(raised.exception.detail['detail'], f'Товар с индексом {deleted_id} не найден')
+        self.assertEqual(Product.objects.get(pk=kept.pk).quantity, kept.quantity)
+
+
+class SaleBatchTests(APITestCase):
+    url = '/api/v1/sales/batch/'
+
+    def setUp(self):
+        self.user, self.client = create_tenant('batch', products=2, stock=5)
+        self.first, self.second = Product.objects.filter(storage=self.user.company.storage).order_by('id')
+
+    def post(self, sales, all_or_nothing=False):
+        return self.client.post(self.url, {'sales': sales, 'all_or_nothing': all_or_nothing}, format='json')
+
+    def sale(self, *lines):
+        return {'buyer_name': 'Покупатель', 'product_sales': [
+            {'product_id': product.id, 'quantity': quantity} for product, quantity in lines
+        ]}
+
+    def stock(self):
+        return list(Product.objects.filter(pk__in=[self.first.pk, self.second.pk]).order_by('id')
+                    .values_list('quantity', flat=True))
+
+    def test_partial_batch_keeps_the_valid_sales(self):
+        response = self.post([
+            self.sale((self.first, 3)),
+            {'buyer_name': 'Покупатель'},
+            self.sale((self.first, 3), (self.second, 1)),
+            self.sale((self.second, 2)),
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 2))
+        results = response.data['results']
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        self.assertIn('id', results[0])
+        self.assertEqual(results[1]['detail'], 'Неверный формат данных')
+        self.assertIn('3 из 5 уже заняты предыдущими продажами пакета', results[2]['detail'])
+        self.assertIn('id', results[3])
+        self.assertEqual(self.stock(), [2, 3])
+        self.assertEqual(set(Sale.objects.values_list('id', flat=True)), {results[0]['id'], results[3]['id']})
+
+    def test_all_or_nothing_rejects_the_whole_batch(self):
+        response = self.post([self.sale((self.first, 3)), self.sale((self.first, 3))], all_or_nothing=True)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.data['created'], response.data['failed']), (0, 2))
+        first, second = response.data['results']
+        # The first sale fits the stock; only the one that exceeds it is blamed.
+        self.assertEqual(first, {'index': 0, 'detail': 'Продажа не проведена из-за ошибок в пакете'})
+        self.assertEqual(second['index'], 1)
+        self.assertIn('3 из 5 уже заняты', second['detail'])
+        self.assertEqual(self.stock(), [5, 5])
+        self.assertFalse(Sale.objects.exists())
+
+    def test_sale_over_the_stock_on_its_own(self):
+        response = self.post([self.sale((self.first, 6)), self.sale((self.second, 1))], all_or_nothing=True)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Максимальное количество 5', response.data['results'][0]['detail'])
+        self.assertEqual(self.stock(), [5, 5])
+
+        response = self.post([self.sale((self.first, 5)), self.sale((self.second, 5))])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), [0, 0])
+
+
+class ProfitSeriesValidationTests(APITestCase):
+    def test_range_is_checked_before_building_the_series(self):
+        _, client = create_tenant('series')
+        url = '/api/v1/sales/analytics/profit'
+
+        response = client.get(url, {'start_date': '2025-02-01', 'end_date': '2025-01-01', 'group_by': 'day'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('end_date', response.data)
+
+        response = client.get(url, {'start_date': '0001-01-01', 'end_date': '9999-12-31', 'group_by': 'day'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('group_by', response.data)
+
+        response = client.get(url, {'start_date': '0001-01-01', 'end_date': '9999-12-31', 'group_by': 'year'})
+        self.assertEqual(response.status_code, 400)
+        response = client.get(url, {'start_date': '2000-01-01', 'end_date': '2025-12-31', 'group_by': 'month'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['series']), 312)
+
+
+class KeysetPaginationTests(APITestCase):
+    def test_equal_values_are_paged_once(self):
+        user, client = create_tenant('pages', products=4)
+        create_sales(client, user, 23)
+        sales = list(Sale.objects.filter(company=user.company).order_by('id'))
+        for number, sale in enumerate(sales):
+            sale.total_amount = (10, 20, 20)[number % 3]
+            sale.items_count = number % 2
+        Sale.objects.bulk_update(sales, ['total_amount', 'items_count'])
+
+        for ordering in ('-total_amount', 'total_amount', 'items_count,-sale_date', 'sale_date'):
+            with self.subTest(ordering):
+                ids = []
+                url = f'/api/v1/sales/get/?page_size=4&ordering={ordering}'
+                while url:
+                    response = client.get(url).json()
+                    ids += [sale['id'] for sale in response['results']]
+                    url = response['next']
+                    # Rows inserted between pages must not shift the ones still to come.
+                    Sale.objects.create(company=user.company, buyer_name='new', total_amount=20, items_count=1,
+                                        total_cost=0, sale_date=date.today())
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertLessEqual({sale.id for sale in sales}, set(ids))
+
+    def test_previous_links_return_the_same_pages(self):
+        user, client = create_tenant('backwards', products=4)
+        create_sales(client, user, 17)
+        sales = list(Sale.objects.filter(company=user.company).order_by('id'))
+        for number, sale in enumerate(sales):
+            sale.total_amount = (10, 20, 20)[number % 3]
+            sale.sale_date = date.today() - timedelta(days=number % 2)
+        Sale.objects.bulk_update(sales, ['total_amount', 'sale_date'])
+
+        for ordering in ('-total_amount', 'sale_date', '-sale_date,total_amount', '-id'):
+            with self.subTest(ordering):
+                forward = []
+                url = f'/api/v1/sales/get/?page_size=4&ordering={ordering}'
+                while url:
+                    response = client.get(url).json()
+                    forward.append([sale['id'] for sale in response['results']])
+                    url = response['next']
+                self.assertEqual(sorted(sum(forward, [])), [sale.id for sale in sales])
+
+                backward = [forward[-1]]
+                url = response['previous']
+                while url:
+                    response = client.get(url).json()
+                    backward.append([sale['id'] for sale in response['results']])
+                    url = response['previous']
+                self.assertEqual(backward[::-1], forward)
+
+    def test_bad_cursor_is_not_found(self):
+        _, client = create_tenant('cursor')
+        for cursor in ('garbage', 'cD1ub3Rqc29u'):
+            with self.subTest(cursor):
+                self.assertEqual(client.get(f'/api/v1/sales/get/?cursor={cursor}').status_code, 404)
+
+
+class ConcurrentSaleTests(TransactionTestCase):
+    def test_stock_matches_sold_quantity(self):
+        user, _ = create_tenant('stress', products=3, stock=100)
+        product_ids = list(Product.objects.filter(storage=user.company.storage).values_list('id', flat=True))
+
+        report = stress_sales(user, product_ids, threads=8, requests=15)
+
+        self.assertEqual(report['errors'], 0)
+        # Demand is about twice the stock, so some sales have to be refused.
+        self.assertGreater(report['rejected'], 0)
+        self.assertEqual(report['created'] + report['rejected'], 8 * 15)
+        self.assertGreater(report['sales_per_second'], 0)
+        for product_id, quantity in report['stock'].items():
+            self.assertGreaterEqual(quantity, 0)
+            self.assertEqual(quantity, 100 - report['sold'][product_id])
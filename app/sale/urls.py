@@ -1,11 +1,15 @@
 from django.urls import path
-from .views import SaleView, SaleIdView, SaleGetView, SalePatchView, AnalyticsProfitView, AnalyticsTopProductView
+from .views import SaleView, SaleBatchView, SaleIdView, SaleGetView, SalePatchView, SaleExportView, AnalyticsProfitView, AnalyticsTopProductView, \
+    AnalyticsCacheStatsView
 
 urlpatterns = [
     path('', SaleView.as_view(), name="sale"),
+    path('batch/', SaleBatchView.as_view(), name="sale-batch"),
     path('get/', SaleGetView.as_view(), name="sale"),
+    path('export/', SaleExportView.as_view(), name="sale-export"),
     path('sale/<int:id>', SaleIdView.as_view(), name="sale"),
     path('patch/<int:id>', SalePatchView.as_view(), name="sale"),
     path('analytics/profit', AnalyticsProfitView.as_view(), name='analytics'),
     path('analytics/top-products/', AnalyticsTopProductView.as_view(), name='top-products'),
+    path('analytics/cache-stats/', AnalyticsCacheStatsView.as_view(), name='analytics-cache-stats'),
 ]
\ No newline at end of file
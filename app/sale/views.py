@@ -1,25 +1,56 @@
 from rest_framework.views import APIView
+from rest_framework.permissions import IsAdminUser
 from rest_framework.generics import ListAPIView
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 from rest_framework import status
-from django.db.models import F, Sum, Avg, Count
-from datetime import date
-
+from rest_framework.exceptions import ValidationError
+from drf_spectacular.utils import extend_schema, OpenApiParameter
+from django.db import transaction
+from django.db.models import F, Q, Sum, Avg, Count, Func, Window
+from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
+from datetime import date, timedelta
+from decimal import Decimal
+
+from core.pagination import KeysetPagination
+from core.streaming import ExportSerializer, ExportContentNegotiation, streaming_export
 from supply.permissions import HasCompanyPermission, HasStoragePermission
-from .models import Sale, ProductSale
+from .models import Sale, ProductSale, DailySalesRollup, ProductSalesTotal, DailyProductSales
 from supply.models import Product
-from .serializers import SaleSerializer, ProductSaleSerializer, SalePatchSerializer, AnalyticsSerializer
+from .serializers import SaleSerializer, ProductSaleSerializer, SalePatchSerializer, AnalyticsSerializer, \
+    SaleBatchSerializer, TopProductsSerializer
+from .services import create_sale, create_sales_batch, restore_stock
+from .rollups import record_sales, sale_lines, clear_rollups
+from .cache import cached_analytics, cache_stats
 
 
 class SaleGetView(ListAPIView):
     permission_classes = [HasCompanyPermission, HasStoragePermission]
-    pagination_class = PageNumberPagination
+    pagination_class = KeysetPagination
     serializer_class = SaleSerializer
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['id', 'sale_date', 'total_amount', 'items_count']
+    ordering = ['-id']
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('sale_date', type=str, required=False),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
-        company = self.request.user.company
-        return Sale.objects.filter(company=company).prefetch_related('product_sales')
+        company = self.request.tenant.company
+        sales = Sale.objects.filter(company=company).prefetch_related('product_sales')
+
+        sale_date = self.request.query_params.get('sale_date')
+        if sale_date:
+            try:
+                sales = sales.filter(sale_date=date.fromisoformat(sale_date))
+            except ValueError:
+                raise ValidationError({"detail": 'Дата продажи должна быть в формате ГГГГ-ММ-ДД'})
+        return sales
 
 
 class SalePatchView(APIView):
@@ -27,7 +58,7 @@ class SalePatchView(APIView):
     serializer_class = SalePatchSerializer
 
     def patch(self, request, *args, **kwargs):
-        company = request.user.company
+        company = request.tenant.company
         id = kwargs.get('id')
 
         try:
@@ -35,7 +66,18 @@ class SalePatchView(APIView):
             serializer = SalePatchSerializer(sale, data=request.data, partial=True)
 
             if serializer.is_valid():
-                serializer.save()
+                with transaction.atomic():
+                    new_date = serializer.validated_data.get('sale_date', sale.sale_date)
+                    lines = []
+                    moved = []
+                    if new_date != sale.sale_date:
+                        lines = sale_lines(ProductSale.objects.filter(sale=sale))
+                        record_sales(company.id, lines, -1, sales=[sale])
+                        moved = [sale]
+                    serializer.save()
+                    for line in lines:
+                        line['sale_date'] = new_date
+                    record_sales(company.id, lines, sales=moved)
                 return Response(serializer.data, status=status.HTTP_200_OK)
             else:
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -50,59 +92,99 @@ class SaleView(APIView):
     serializer_class = SaleSerializer
 
     def post(self, request, *args, **kwargs):
-        company = request.user.company
-        storage = company.storage
+        company = request.tenant.company
         data = request.data
         try:
-            sale = Sale.objects.create(company=company, buyer_name=data['buyer_name'], sale_date=date.today())
-
-            for product in data["product_sales"]:
-                product_id = product["product_id"]
-                quantity = product["quantity"]
-
-                storage_product = Product.objects.get(id=product_id)
-                if storage_product.quantity < quantity:
-                    sale.delete()
-                    res = f'Количество продукта {storage_product.title}(id:{product_id}) меньше указанного. Максимальное количество {storage_product.quantity}'
-                    return Response({"detail": res}, status=status.HTTP_400_BAD_REQUEST)
-
-            for product in data["product_sales"]:
-                product_id = product["product_id"]
-                quantity = product["quantity"]
-                storage_product = Product.objects.get(id=product_id)
-                storage_product.quantity -= quantity
-                storage_product.save()
-                ProductSale.objects.create(product=storage_product, sale=sale, quantity=quantity)
-
-        except Product.DoesNotExist:
-            if sale: sale.delete()
-            return Response({"detail": f'Товар с индексом {product_id} не найден'})
+            buyer_name = data['buyer_name']
+            items = data['product_sales']
+        except (KeyError, TypeError):
+            return Response({"detail": 'Неверный формат данных'}, status=status.HTTP_400_BAD_REQUEST)
+
+        sale = create_sale(company, buyer_name, items)
 
         return Response(
             {"ditail": f'Покупка id{sale.id} от {sale.sale_date} реализована. Покупатель {sale.buyer_name}'},
             status=status.HTTP_200_OK)
 
     def delete(self, request, *args, **kwargs):
-        company = request.user.company
+        company = request.tenant.company
         sales = Sale.objects.filter(company=company)
         deleted_ids = list(sales.values_list('id', flat=True))
-        product_sales = ProductSale.objects.filter(sale__in=sales).values('product_id', 'quantity')
-        for product_sale in product_sales:
-            Product.objects.filter(id=product_sale['product_id']).update(
-                quantity=F('quantity') + product_sale['quantity'])
-
-        sales.delete()
+        with transaction.atomic():
+            restore_stock(ProductSale.objects.filter(sale__company=company))
+            sales.delete()
+            clear_rollups(company.id)
         return Response({"ditail": f'Поставки удалены id:{deleted_ids}'},
                         status=status.HTTP_200_OK)
 
 
+class SaleBatchView(APIView):
+    permission_classes = [HasCompanyPermission, HasStoragePermission]
+    serializer_class = SaleBatchSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        results, committed = create_sales_batch(request.tenant.company, data['sales'], data['all_or_nothing'])
+        created = sum(1 for result in results if 'id' in result)
+
+        if not committed:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif created == len(results):
+            response_status = status.HTTP_201_CREATED
+        else:
+            response_status = status.HTTP_200_OK
+        return Response({
+            'created': created,
+            'failed': len(results) - created,
+            'results': results,
+        }, status=response_status)
+
+
+class SaleExportView(APIView):
+    permission_classes = [HasCompanyPermission, HasStoragePermission]
+    serializer_class = ExportSerializer
+    content_negotiation_class = ExportContentNegotiation
+    columns = ('sale_id', 'sale_date', 'buyer_name', 'product_id', 'product_title', 'quantity', 'unit_price',
+               'unit_cost')
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('file_format', type=str, enum=['csv', 'ndjson', 'json'], default='csv'),
+            OpenApiParameter('start_date', type=str, required=False),
+            OpenApiParameter('end_date', type=str, required=False),
+            OpenApiParameter('product_id', type=int, required=False),
+        ]
+    )
+    def get(self, request):
+        serializer = self.serializer_class(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        lines = ProductSale.objects.filter(sale__company=request.tenant.company)
+        if data.get('start_date'):
+            lines = lines.filter(sale__sale_date__gte=data['start_date'])
+        if data.get('end_date'):
+            lines = lines.filter(sale__sale_date__lte=data['end_date'])
+        if data.get('product_id'):
+            lines = lines.filter(product_id=data['product_id'])
+
+        lines = lines.order_by('sale_id', 'id').values_list(
+            'sale_id', 'sale__sale_date', 'sale__buyer_name', 'product_id', 'product__title', 'quantity',
+            'unit_price', 'unit_cost',
+        )
+        return streaming_export('sales', self.columns, lines, data['file_format'])
+
+
 class SaleIdView(APIView):
     permission_classes = [HasCompanyPermission, HasStoragePermission]
     serializer_class = SaleSerializer
 
     def get(self, request, *args, **kwargs):
         id = kwargs.get('id')
-        company = request.user.company
+        company = request.tenant.company
         try:
             sale = Sale.objects.get(id=id, company=company)
             serializer = SaleSerializer(sale)
@@ -113,7 +195,7 @@ class SaleIdView(APIView):
 
     def delete(self, request, *args, **kwargs):
         id = kwargs.get('id')
-        company = request.user.company
+        company = request.tenant.company
 
         try:
             sale = Sale.objects.get(id=id, company=company)
@@ -121,132 +203,323 @@ class SaleIdView(APIView):
             return Response({"detail": f'Покупка с id:{id} не найдена'},
                             status=status.HTTP_404_NOT_FOUND)
 
-        product_sales = ProductSale.objects.filter(sale=sale).select_related('product')
-        products_id = []
-        for ps in product_sales:
-            products_id.append(str(ps.product.id))
-            ps.product.quantity += ps.quantity
-            ps.product.save()
         sale_serializer = SaleSerializer(sale).data
-        sale.delete()
-        products_id = ','.join(products_id)
+        with transaction.atomic():
+            product_sales = ProductSale.objects.filter(sale=sale)
+            record_sales(company.id, sale_lines(product_sales), -1, sales=[sale])
+            restored = restore_stock(product_sales)
+            sale.delete()
+        products_id = ','.join(str(product_id) for product_id in restored)
         return Response({
             "detail": f"Удалена поставка {sale_serializer['id']} от {sale_serializer['sale_date']}. Продукты: {products_id}"},
             status=status.HTTP_200_OK)
 
 
-from drf_spectacular.utils import extend_schema, OpenApiParameter
+TRUNC_FUNCTIONS = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth, 'year': TruncYear}
+PROFIT_FIELDS = {
+    'total_profit': 'revenue',
+    'net_profit': 'net_profit',
+    'sales_count': 'sale_count',
+    'product_count': 'line_count',
+}
 
 
-class AnalyticsProfitView(APIView):
+class RunningTotal(Func):
+    # SUM() OVER (...) applied to an already grouped aggregate.
+    function = 'SUM'
+    window_compatible = True
+
+
+def bucket_start(day, group_by):
+    if group_by == 'week':
+        return day - timedelta(days=day.weekday())
+    elif group_by == 'month':
+        return day.replace(day=1)
+    elif group_by == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(day, group_by):
+    if group_by == 'week':
+        return day + timedelta(days=7)
+    elif group_by == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    elif group_by == 'year':
+        return day.replace(year=day.year + 1)
+    return day + timedelta(days=1)
+
+
+def year_before(day):
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:
+        return day.replace(year=day.year - 1, day=28)
+
+
+class AnalyticsRangeMixin:
+    def get_date_range(self, period, start_date, end_date):
+        today = date.today()
+
+        if start_date and end_date:
+            return start_date, end_date
+        elif period == 'day':
+            return today, today
+        elif period == 'week':
+            return today - timedelta(days=7), None
+        elif period == 'month':
+            return today.replace(day=1), None
+        elif period == 'year':
+            return today.replace(month=1, day=1), None
+        return None, None
+
+    def filter_by_range(self, queryset, period, start_date, end_date):
+        start, end = self.get_date_range(period, start_date, end_date)
+        if start is not None:
+            queryset = queryset.filter(date__gte=start)
+        if end is not None:
+            queryset = queryset.filter(date__lte=end)
+        return queryset
+
+    def resolved_range(self, period, start_date, end_date):
+        # Relative periods are keyed by the dates they cover, so yesterday's
+        # "week" is not served today.
+        start, end = self.get_date_range(period, start_date, end_date)
+        if start is not None and end is None:
+            end = date.today()
+        return start, end
+
+    def cached_response(self, view_name, company, params, compute):
+        payload, outcome = cached_analytics(view_name, company.id, params, compute)
+        response = Response(payload)
+        response['X-Cache'] = outcome.upper()
+        return response
+
+
+class AnalyticsProfitView(AnalyticsRangeMixin, APIView):
     permission_classes = [HasCompanyPermission, HasStoragePermission]
     serializer_class = AnalyticsSerializer
 
     @extend_schema(
         parameters=[
             OpenApiParameter('period', type=str, enum=['day', 'week', 'month', 'year'], default='day'),
-            OpenApiParameter('date_end', type=str, required=False),
-            OpenApiParameter('date_start', type=str, required=False),
+            OpenApiParameter('start_date', type=str, required=False),
+            OpenApiParameter('end_date', type=str, required=False),
+            OpenApiParameter('group_by', type=str, enum=['day', 'week', 'month', 'year'], required=False),
+            OpenApiParameter('cumulative', type=bool, required=False, default=False),
+            OpenApiParameter('compare', type=str, enum=['previous', 'last_year'], required=False),
         ]
     )
     def get(self, request):
         serializer = self.serializer_class(data=request.query_params)
         serializer.is_valid(raise_exception=True)
 
-        company = request.user.company
+        company = request.tenant.company
         data = serializer.validated_data
 
         period = data.get('period', 'day')
         start_date = data.get('start_date', None)
         end_date = data.get('end_date', None)
+        group_by = data.get('group_by')
+        compare = data.get('compare')
+
+        params = {
+            'period': period,
+            'range': self.resolved_range(period, start_date, end_date),
+            'dates': (start_date, end_date),
+            'group_by': group_by,
+            'cumulative': data['cumulative'] if group_by else False,
+            'compare': compare,
+        }
+        return self.cached_response(
+            'profit', company, params,
+            lambda: self.get_payload(company, period, start_date, end_date, group_by, data['cumulative'], compare),
+        )
+
+    def get_payload(self, company, period, start_date, end_date, group_by, cumulative, compare=None):
+        if compare:
+            start, end = self.resolved_range(period, start_date, end_date)
+            label = f'{start_date} - {end_date}' if start_date or end_date else period
+            return self.get_profit_comparison(company, label, start, end, compare)
 
-        sales = self.get_sales_queryset(company, period, start_date, end_date)
-        profit_stats = self.get_profit_stats(sales)
+        rollups = self.filter_by_range(DailySalesRollup.objects.filter(company=company), period, start_date, end_date)
+        if group_by:
+            start, end = self.get_date_range(period, start_date, end_date)
+            series = self.get_profit_series(rollups, group_by, start, end, cumulative)
+        else:
+            profit_stats = self.get_profit_stats(rollups)
 
         if start_date or end_date:
             period = f'{start_date} - {end_date}'
 
-        return Response({
+        if group_by:
+            return {
+                'period': period,
+                'group_by': group_by,
+                'series': series
+            }
+        return {
             'period': period,
             'profit': profit_stats
+        }
+
+    def get_profit_stats(self, rollups):
+        stats = rollups.aggregate(**{name: Sum(field) for name, field in PROFIT_FIELDS.items()})
+        return self.format_profit_stats(stats)
+
+    def format_profit_stats(self, stats, prefix=''):
+        return {
+            'total_profit': float(stats[f'{prefix}total_profit'] or Decimal('0')),
+            'net_profit': float(stats[f'{prefix}net_profit'] or Decimal('0')),
+            'sales_count': stats[f'{prefix}sales_count'] or 0,
+            'product_count': stats[f'{prefix}product_count'] or 0
+        }
+
+    def get_previous_range(self, start, end, compare):
+        if compare == 'last_year':
+            return year_before(start), year_before(end)
+        previous_end = start - timedelta(days=1)
+        return previous_end - (end - start), previous_end
+
+    def get_profit_comparison(self, company, label, start, end, compare):
+        previous_start, previous_end = self.get_previous_range(start, end, compare)
+        windows = {
+            'current': Q(date__range=(start, end)),
+            'previous': Q(date__range=(previous_start, previous_end)),
+        }
+        # Both periods come from one scan: each total only sums its own dates.
+        stats = DailySalesRollup.objects.filter(company=company).filter(
+            windows['current'] | windows['previous']
+        ).aggregate(**{
+            f'{window}_{name}': Sum(field, filter=condition)
+            for window, condition in windows.items()
+            for name, field in PROFIT_FIELDS.items()
         })
 
-    def get_sales_queryset(self, company, period, start_date, end_date):
-        today = date.today()
+        current = self.format_profit_stats(stats, 'current_')
+        previous = self.format_profit_stats(stats, 'previous_')
+        return {
+            'period': label,
+            'profit': current,
+            'comparison': {
+                'compare': compare,
+                'period': f'{previous_start} - {previous_end}',
+                'profit': previous,
+                'delta': {
+                    name: round(current[name] - previous[name], 2) for name in PROFIT_FIELDS
+                },
+                'delta_percent': {
+                    name: round((current[name] - previous[name]) * 100 / previous[name], 2)
+                    if previous[name] else None
+                    for name in PROFIT_FIELDS
+                },
+            },
+        }
 
-        if start_date and end_date:
-            return Sale.objects.filter(
-                company=company,
-                sale_date__range=[start_date, end_date]
+    def get_profit_series(self, rollups, group_by, start, end, cumulative):
+        rows = rollups.annotate(bucket=TRUNC_FUNCTIONS[group_by]('date')).values('bucket').annotate(
+            total_profit=Sum('revenue'),
+            net_profit=Sum('net_profit'),
+            sales_count=Sum('sale_count'),
+            product_count=Sum('line_count'),
+        ).order_by('bucket')
+        if cumulative:
+            running = {'order_by': F('bucket').asc()}
+            rows = rows.annotate(
+                cumulative_total_profit=Window(RunningTotal(F('total_profit')), **running),
+                cumulative_net_profit=Window(RunningTotal(F('net_profit')), **running),
             )
-        elif period == 'day':
-            return Sale.objects.filter(company=company, sale_date=today)
-        elif period == 'week':
-            week = today - timedelta(days=7)
-            return Sale.objects.filter(company=company, sale_date__gte=week)
-        elif period == 'month':
-            month = today.replace(day=1)
-            return Sale.objects.filter(company=company, sale_date__gte=month)
-        elif period == 'year':
-            year = today.replace(month=1, day=1)
-            return Sale.objects.filter(company=company, sale_date__gte=year)
-        else:
-            return Sale.objects.filter(company=company)
+        rows = {row['bucket']: row for row in rows}
+
+        end = bucket_start(end or date.today(), group_by)
+        bucket = bucket_start(start or min(rows, default=end), group_by)
+        series = []
+        running_totals = {'cumulative_total_profit': Decimal('0'), 'cumulative_net_profit': Decimal('0')}
+        while bucket <= end:
+            row = rows.get(bucket, {})
+            point = {
+                'bucket': bucket,
+                'total_profit': float(row.get('total_profit') or 0),
+                'net_profit': float(row.get('net_profit') or 0),
+                'sales_count': row.get('sales_count') or 0,
+                'product_count': row.get('product_count') or 0,
+            }
+            if cumulative:
+                for key in running_totals:
+                    running_totals[key] = row.get(key, running_totals[key])
+                    point[key] = float(running_totals[key])
+            series.append(point)
+            bucket = next_bucket(bucket, group_by)
+        return series
+
+
+class AnalyticsTopProductView(AnalyticsRangeMixin, APIView):
+    permission_classes = [HasCompanyPermission, HasStoragePermission]
+    serializer_class = TopProductsSerializer
 
-    def get_profit_stats(self, sales):
-        product_sales = ProductSale.objects.filter(sale__in=sales)
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('limit', type=int, required=False, default=10),
+            OpenApiParameter('period', type=str, enum=['day', 'week', 'month', 'year'], required=False),
+            OpenApiParameter('start_date', type=str, required=False),
+            OpenApiParameter('end_date', type=str, required=False),
+        ]
+    )
+    def get(self, request):
+        serializer = self.serializer_class(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
 
-        total_profit = product_sales.aggregate(total=Sum(F('quantity') * F('product__sale_price')))
-        total_profit = total_profit['total'] or Decimal('0')
+        company = request.tenant.company
+        limit = data['limit']
+        period = data.get('period')
+        start_date = data.get('start_date')
+        end_date = data.get('end_date')
+        windowed = bool(period or (start_date and end_date))
 
-        net_profit = product_sales.aggregate(
-            net=Sum(F('quantity') * (
-                    F('product__sale_price') - F('product__purchase_price')
-            ))
+        params = {
+            'limit': limit,
+            'range': self.resolved_range(period, start_date, end_date) if windowed else None,
+        }
+        return self.cached_response(
+            'top-products', company, params,
+            lambda: self.get_payload(company, limit, period, start_date, end_date, windowed),
         )
-        net_profit = net_profit['net'] or Decimal('0')
 
-        sales_count = sales.count()
-        product_sales_count = product_sales.count()
+    def get_payload(self, company, limit, period, start_date, end_date, windowed):
+        if windowed:
+            rows = self.filter_by_range(
+                DailyProductSales.objects.filter(company=company), period, start_date, end_date
+            ).values('product__title', 'product__id').annotate(
+                total_quantity=Sum('quantity_sold'),
+                sales_count=Sum('sales_count'),
+                net_profit=Sum('net_profit'),
+            ).filter(sales_count__gt=0)
+        else:
+            rows = ProductSalesTotal.objects.filter(company=company, sales_count__gt=0).values(
+                'product__title', 'product__id', 'sales_count', 'net_profit', total_quantity=F('quantity_sold'),
+            )
 
         return {
-            'total_profit': float(total_profit),
-            'net_profit': float(net_profit),
-            'sales_count': sales_count,
-            'product_count': product_sales_count
+            'top_products': self.get_top_products(rows, limit),
+            'top_profit_products': self.get_top_profit_products(rows, limit),
         }
 
+    def get_top_products(self, rows, limit):
+        return [
+            {key: row[key] for key in ('product__title', 'product__id', 'total_quantity', 'sales_count')}
+            for row in rows.order_by('-total_quantity')[:limit]
+        ]
 
-class AnalyticsTopProductView(APIView):
-    permission_classes = [HasCompanyPermission, HasStoragePermission]
-
-    def get(self, request):
-        company = request.user.company
-        sales = Sale.objects.filter(company=company)
+    def get_top_profit_products(self, rows, limit):
+        return [
+            {key: row[key] for key in ('product__title', 'product__id', 'net_profit')}
+            for row in rows.order_by('-net_profit')[:limit]
+        ]
 
-        top_products = self.get_top_products(sales)
-        top_profit_products = self.get_top_profit_products(sales)
 
-        return Response({
-            'top_products': top_products[:10],
-            'top_profit_products': top_profit_products[:10],
-        })
+class AnalyticsCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
 
-    def get_top_products(self, sales):
-        return ProductSale.objects.filter(sale__in=sales).values(
-            'product__title',
-            'product__id'
-        ).annotate(
-            total_quantity=Sum('quantity'),
-            sales_count=Count('id')
-        ).order_by('-total_quantity')
-
-    def get_top_profit_products(self, sales):
-        return ProductSale.objects.filter(sale__in=sales).values(
-            'product__title',
-            'product__id'
-        ).annotate(
-            net_profit=Sum(F('quantity') * (
-                    F('product__sale_price') - F('product__purchase_price')
-            ))
-        ).order_by('-net_profit')
+    def get(self, request):
+        return Response(cache_stats())
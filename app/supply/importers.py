@@ -0,0 +1,268 @@
+import abc
+import csv
+import io
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction, DatabaseError
+from django.db.models import Q
+
+from sale.cache import bump_sales_version
+from .models import Supply, Supplier, SupplyProduct, Product
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(filename, default='csv'):
+    name = (filename or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def read_rows(stream, file_format):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row
+
+
+def _required(row, field):
+    value = row.get(field)
+    if value is None or str(value).strip() == '':
+        raise RowError(f'Не заполнено поле {field}')
+    return str(value).strip()
+
+
+def _decimal(row, field, default=None):
+    if default is not None and row.get(field) in (None, ''):
+        return default
+    try:
+        value = Decimal(_required(row, field))
+    except InvalidOperation:
+        raise RowError(f'Поле {field} указано в неверном формате')
+    if value < 0:
+        raise RowError(f'Поле {field} не может быть отрицательным')
+    return value.quantize(Decimal('0.01'))
+
+
+def _positive_int(row, field, default=None):
+    if default is not None and row.get(field) in (None, ''):
+        return default
+    try:
+        value = int(_required(row, field))
+    except ValueError:
+        raise RowError(f'Поле {field} должно быть целым числом')
+    if value < 0:
+        raise RowError(f'Поле {field} не может быть отрицательным')
+    return value
+
+
+class BaseImporter(abc.ABC):
+    def __init__(self, company, chunk_size=IMPORT_CHUNK_SIZE):
+        self.company = company
+        self.chunk_size = chunk_size
+        self.report = {'processed': 0, 'imported': 0, 'failed': 0, 'errors': []}
+
+    def add_error(self, line, detail):
+        self.report['failed'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append({'line': line, 'detail': detail})
+
+    def run(self, rows, progress=None):
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+
+            valid = []
+            for line, row in chunk:
+                try:
+                    if not isinstance(row, dict):
+                        raise RowError('Неверный формат строки')
+                    valid.append((line, self.parse_row(row)))
+                except RowError as exc:
+                    self.add_error(line, str(exc))
+
+            if valid:
+                try:
+                    with transaction.atomic():
+                        self.report['imported'] += self.save_chunk(valid)
+                except DatabaseError as exc:
+                    for line, _ in valid:
+                        self.add_error(line, f'Ошибка базы данных: {exc}')
+
+            self.report['processed'] += len(chunk)
+            if progress is not None:
+                progress(self.report)
+        return self.report
+
+    @abc.abstractmethod
+    def parse_row(self, row):
+        pass
+
+    @abc.abstractmethod
+    def save_chunk(self, rows):
+        pass
+
+    def reject(self, rows, predicate, detail):
+        kept = []
+        for line, data in rows:
+            if predicate(data):
+                self.add_error(line, detail(data))
+            else:
+                kept.append((line, data))
+        return kept
+
+
+class ProductImporter(BaseImporter):
+    def parse_row(self, row):
+        return {
+            'title': _required(row, 'title'),
+            'sale_price': _decimal(row, 'sale_price'),
+            'purchase_price': _decimal(row, 'purchase_price', default=Decimal('0.00')),
+            'quantity': _positive_int(row, 'quantity', default=0),
+        }
+
+    def save_chunk(self, rows):
+        storage = self.company.storage
+        rows = list({data['title']: (line, data) for line, data in rows}.values())
+        foreign = set(
+            Product.objects.filter(title__in=[data['title'] for _, data in rows])
+            .exclude(storage=storage).values_list('title', flat=True)
+        )
+        rows = self.reject(rows, lambda data: data['title'] in foreign,
+                           lambda data: f"Товар {data['title']} уже существует в другой компании")
+
+        Product.objects.bulk_create(
+            [Product(storage=storage, **data) for _, data in rows],
+            update_conflicts=True,
+            unique_fields=['title'],
+            update_fields=['purchase_price', 'sale_price', 'quantity'],
+        )
+        bump_sales_version(self.company.id)
+        return len(rows)
+
+
+class SupplierImporter(BaseImporter):
+    def parse_row(self, row):
+        return {
+            'title': _required(row, 'title'),
+            'inn': _required(row, 'inn'),
+        }
+
+    def save_chunk(self, rows):
+        rows = list({data['inn']: (line, data) for line, data in rows}.values())
+        existing = Supplier.objects.filter(
+            Q(inn__in=[data['inn'] for _, data in rows]) | Q(title__in=[data['title'] for _, data in rows])
+        ).values_list('company_id', 'inn', 'title')
+        foreign_inns = {inn for company_id, inn, _ in existing if company_id != self.company.id}
+        titles = {title: inn for _, inn, title in existing}
+
+        rows = self.reject(rows, lambda data: data['inn'] in foreign_inns,
+                           lambda data: f"Поставщик с ИНН {data['inn']} принадлежит другой компании")
+        rows = self.reject(rows, lambda data: titles.get(data['title'], data['inn']) != data['inn'],
+                           lambda data: f"Поставщик {data['title']} уже существует с другим ИНН")
+
+        Supplier.objects.bulk_create(
+            [Supplier(company=self.company, **data) for _, data in rows],
+            update_conflicts=True,
+            unique_fields=['inn'],
+            update_fields=['title'],
+        )
+        return len(rows)
+
+
+class SupplyImporter(BaseImporter):
+    # Supplies are imported as delivery history: product stock is taken from
+    # the product import and is not changed here. Every import creates its
+    # own supplies, so supplies received through the API are never touched,
+    # and keeps running totals per line, so a (supplier, date, product)
+    # group split across chunks ends up with the same quantity as in one.
+    def __init__(self, company, chunk_size=IMPORT_CHUNK_SIZE):
+        super().__init__(company, chunk_size)
+        self.supplies = {}
+        self.lines = {}
+
+    def parse_row(self, row):
+        try:
+            delivery_date = date.fromisoformat(_required(row, 'delivery_date'))
+        except ValueError:
+            raise RowError('Поле delivery_date должно быть в формате ГГГГ-ММ-ДД')
+        quantity = _positive_int(row, 'quantity')
+        if not quantity:
+            raise RowError('Поле quantity должно быть больше нуля')
+        return {
+            'supplier_inn': _required(row, 'supplier_inn'),
+            'delivery_date': delivery_date,
+            'product_title': _required(row, 'product_title'),
+            'quantity': quantity,
+        }
+
+    def save_chunk(self, rows):
+        suppliers = dict(Supplier.objects.filter(
+            company=self.company, inn__in={data['supplier_inn'] for _, data in rows}
+        ).values_list('inn', 'id'))
+        products = dict(Product.objects.filter(
+            storage=self.company.storage, title__in={data['product_title'] for _, data in rows}
+        ).values_list('title', 'id'))
+
+        rows = self.reject(rows, lambda data: data['supplier_inn'] not in suppliers,
+                           lambda data: f"Поставщик с ИНН {data['supplier_inn']} не найден")
+        rows = self.reject(rows, lambda data: data['product_title'] not in products,
+                           lambda data: f"Товар {data['product_title']} не найден")
+        if not rows:
+            return 0
+
+        keys = {(suppliers[data['supplier_inn']], data['delivery_date']) for _, data in rows}
+        missing = [key for key in keys if key not in self.supplies]
+        created = Supply.objects.bulk_create([
+            Supply(supplier_id=supplier_id, delivery_date=delivery_date) for supplier_id, delivery_date in missing
+        ])
+        supplies = {**self.supplies, **{key: supply.id for key, supply in zip(missing, created)}}
+
+        lines = {}
+        for _, data in rows:
+            key = (supplies[(suppliers[data['supplier_inn']], data['delivery_date'])], products[data['product_title']])
+            lines[key] = lines.get(key, self.lines.get(key, 0)) + data['quantity']
+
+        SupplyProduct.objects.bulk_create(
+            [SupplyProduct(supply_id=supply_id, product_id=product_id, quantity=quantity)
+             for (supply_id, product_id), quantity in lines.items()],
+            update_conflicts=True,
+            unique_fields=['supply', 'product'],
+            update_fields=['quantity'],
+        )
+        # Only remembered once the chunk is written; a failed chunk is rolled back.
+        self.supplies = supplies
+        self.lines.update(lines)
+        return len(rows)
+
+
+IMPORTERS = {
+    'products': ProductImporter,
+    'suppliers': SupplierImporter,
+    'supplies': SupplyImporter,
+}
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from company.models import Company
+from supply.importers import IMPORTERS, IMPORT_FORMATS, IMPORT_CHUNK_SIZE, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Потоковый импорт товаров, поставщиков или поставок компании из CSV или NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--company', type=int, required=True, help='id компании')
+        parser.add_argument('--format', dest='file_format', choices=IMPORT_FORMATS)
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            company = Company.objects.select_related('storage').get(id=options['company'])
+        except Company.DoesNotExist:
+            raise CommandError(f"Компания с id {options['company']} не найдена")
+        if not hasattr(company, 'storage'):
+            raise CommandError('У компании нет склада')
+
+        file_format = options['file_format'] or detect_format(options['path'])
+        importer = IMPORTERS[options['kind']](company, chunk_size=options['chunk_size'])
+        started = time.perf_counter()
+
+        def progress(report):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"Обработано {report['processed']} строк, импортировано {report['imported']}, "
+                f"ошибок {report['failed']} ({report['processed'] / elapsed:.0f} строк/с)"
+            )
+
+        with open(options['path'], 'rb') as stream:
+            report = importer.run(read_rows(stream, file_format), progress=progress)
+
+        for error in report['errors']:
+            self.stderr.write(f"Строка {error['line']}: {error['detail']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: импортировано {report['imported']} из {report['processed']} строк "
+            f"за {time.perf_counter() - started:.1f} c"
+        ))
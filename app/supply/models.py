@@ -11,12 +11,22 @@ class Supply(models.Model):
     supplier = models.ForeignKey("Supplier", on_delete=models.CASCADE)
     delivery_date = models.DateField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['supplier', '-delivery_date'], name='supply_supplier_date_idx'),
+        ]
+
 
 class SupplyProduct(models.Model):
     supply = models.ForeignKey("Supply", on_delete=models.CASCADE)
     product = models.ForeignKey("Product", on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['supply', 'product'], name='unique_supply_product'),
+        ]
+
 
 class Product(models.Model):
     storage = models.ForeignKey("company.Storage", on_delete=models.CASCADE)
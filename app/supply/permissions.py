@@ -4,11 +4,10 @@ class HasCompanyPermission(permissions.BasePermission):
     message = 'У вас нет привязанных компаний.'
 
     def has_permission(self, request, view):
-        return bool(getattr(request.user, 'company', None))
+        return request.tenant.company is not None
 
 class HasStoragePermission(permissions.BasePermission):
     message = 'У компании нет склада.'
 
     def has_permission(self, request, view):
-        company = getattr(request.user, 'company', None)
-        return bool(getattr(company, 'storage', None))
\ No newline at end of file
+        return request.tenant.storage is not None
\ No newline at end of file
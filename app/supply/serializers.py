@@ -1,15 +1,17 @@
 from rest_framework import serializers
+from monitoring.serializers import TimedSerializerMixin
 from .models import Supply, Supplier, SupplyProduct, Product
+from .services import receive_supply
 
 
-class SupplierSerializer(serializers.ModelSerializer):
+class SupplierSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Supplier
         fields = ['id', 'company', 'title', 'inn']
         read_only_fields = ['company']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ['id', 'storage', 'title', 'purchase_price', 'sale_price', 'quantity']
@@ -36,7 +38,7 @@ class SupplyProductGetSerializer(serializers.ModelSerializer):
         fields = ['product', 'quantity']
 
 
-class SupplySerializer(serializers.ModelSerializer):
+class SupplySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     supplier_id = serializers.IntegerField(source='supplier.id', read_only=True)
     products = SupplyProductGetSerializer(source='supplyproduct_set', many=True, read_only=True)
 
@@ -54,9 +56,9 @@ class SupplyCreateSerializer(serializers.ModelSerializer):
         fields = ['supplier_id', 'delivery_date', 'products']
 
     def create(self, validated_data):
-        supplier = Supplier.objects.get(
-            id=validated_data.pop('supplier_id'),
-            company=self.context['request'].user.company
+        return receive_supply(
+            self.context['request'].tenant.company,
+            validated_data['supplier_id'],
+            validated_data['delivery_date'],
+            validated_data['products'],
         )
-        validated_data['supplier'] = supplier
-        return super().create(validated_data)
@@ -1,3 +1,148 @@
-from django.test import TestCase
+from datetime import date
+from decimal import Decimal
 
-# Create your tests here.
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+
+from core.testing import QueryPlanMixin, create_tenant, create_sales, create_supplies
+from .importers import SupplyImporter
+from .models import Product, Supplier, Supply, SupplyProduct
+from .services import UPDATE_BATCH_SIZE, receive_supply, sale_price_for
+
+
+class SupplyQueryPlanTests(QueryPlanMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('first', 'second'):
+            user, client = create_tenant(name, products=10)
+            supplier = create_supplies(client, user, 20)
+            create_sales(client, user, 10)
+        cls.user = user
+        cls.supplier = supplier
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.user)
+
+    def test_detects_full_scan(self):
+        self.assertTrue(self.full_scans('SELECT * FROM supply_product WHERE quantity > 0'))
+
+    def test_supply_list(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/supplies/'))
+
+    def test_product_list(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/products/?count=true'))
+
+    def test_product_detail(self):
+        product_id = self.user.company.storage.product_set.values_list('id', flat=True).first()
+        self.assertNoFullScans(lambda: self.client.get(f'/api/v1/product/{product_id}/'))
+
+    def test_supplier_list(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/suppliers/'))
+
+    def test_supply_export(self):
+        self.assertNoFullScans(
+            lambda: self.client.get(f'/api/v1/supplies/export/?start_date=2026-01-10&supplier_id={self.supplier.id}')
+        )
+
+    def test_stock_export(self):
+        self.assertNoFullScans(lambda: self.client.get('/api/v1/products/export/'))
+
+
+class SupplyImportTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, client = create_tenant('importer', products=3)
+        cls.supplier = create_supplies(client, cls.user, 1)
+        cls.received = list(SupplyProduct.objects.values_list('id', 'quantity'))
+        titles = list(Product.objects.order_by('id').values_list('title', flat=True))
+        cls.rows = [
+            (line, {'supplier_inn': cls.supplier.inn, 'delivery_date': '2026-01-01',
+                    'product_title': titles[line % 2], 'quantity': line})
+            for line in range(1, 8)
+        ]
+
+    def imported_lines(self):
+        return sorted(SupplyProduct.objects.exclude(id__in=[pk for pk, _ in self.received])
+                      .values_list('product__title', 'quantity'))
+
+    def test_result_does_not_depend_on_chunks(self):
+        results = []
+        for chunk_size in (100, 2, 1):
+            report = SupplyImporter(self.user.company, chunk_size=chunk_size).run(self.rows)
+            self.assertEqual((report['imported'], report['failed']), (7, 0))
+            results.append(self.imported_lines())
+            SupplyProduct.objects.exclude(id__in=[pk for pk, _ in self.received]).delete()
+        self.assertEqual(results[0], [(self.rows[1][1]['product_title'], 12), (self.rows[0][1]['product_title'], 16)])
+        self.assertEqual(results, [results[0]] * 3)
+
+    def test_existing_supplies_are_not_changed(self):
+        supplies = Supply.objects.count()
+        SupplyImporter(self.user.company, chunk_size=3).run(self.rows)
+        self.assertEqual(Supply.objects.count(), supplies + 1)
+        self.assertEqual(list(SupplyProduct.objects.filter(id__in=[pk for pk, _ in self.received])
+                              .values_list('id', 'quantity')), self.received)
+
+
+class SupplyReceiptTests(APITestCase):
+    def setUp(self):
+        self.user, self.client = create_tenant('receiver', products=2, stock=10)
+        self.supplier = Supplier.objects.create(company=self.user.company, title='Поставщик', inn='700000000001')
+        self.first, self.second = Product.objects.filter(storage=self.user.company.storage).order_by('id')
+
+    def post(self, *lines):
+        return self.client.post('/api/v1/supply/', {
+            'supplier_id': self.supplier.id,
+            'delivery_date': '2026-01-01',
+            'products': [{'product_id': product_id, 'quantity': quantity, 'purchase_price': price}
+                         for product_id, quantity, price in lines],
+        }, format='json')
+
+    def test_duplicate_lines_are_merged_and_the_last_price_wins(self):
+        response = self.post((self.first.id, 2, '20.00'), (self.second.id, 1, '5.00'), (self.first.id, 3, '30.00'))
+
+        self.assertEqual(response.status_code, 201)
+        first = Product.objects.get(pk=self.first.pk)
+        self.assertEqual((first.quantity, first.purchase_price, first.sale_price),
+                         (15, Decimal('30.00'), sale_price_for('30.00')))
+        self.assertEqual(Product.objects.get(pk=self.second.pk).quantity, 11)
+        self.assertEqual(sorted(SupplyProduct.objects.values_list('product_id', 'quantity')),
+                         [(self.first.id, 5), (self.second.id, 1)])
+
+    def test_unknown_product_is_rejected_before_any_write(self):
+        other, _ = create_tenant('other', products=1)
+        foreign = Product.objects.get(storage=other.company.storage)
+
+        for product_id in (foreign.id, foreign.id + 1000):
+            response = self.post((self.first.id, 2, '20.00'), (product_id, 1, '5.00'))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['detail'], f'Товар {product_id} не найден')
+
+        self.assertFalse(Supply.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.first.pk).purchase_price, self.first.purchase_price)
+        self.assertEqual(list(Product.objects.values_list('quantity', flat=True)), [10, 10, 100])
+
+    def test_receipt_larger_than_one_update_batch(self):
+        count = UPDATE_BATCH_SIZE * 2 + 1
+        Product.objects.bulk_create([
+            Product(storage=self.user.company.storage, title=f'receiver-extra-{number}', purchase_price=10,
+                    sale_price=13, quantity=0)
+            for number in range(count)
+        ])
+        ids = list(Product.objects.filter(storage=self.user.company.storage, quantity=0).values_list('id', flat=True))
+
+        receive_supply(self.user.company, self.supplier.id, date(2026, 1, 1), [
+            {'product_id': product_id, 'quantity': number + 1, 'purchase_price': Decimal('7.00')}
+            for number, product_id in enumerate(ids)
+        ])
+
+        received = Product.objects.filter(id__in=ids)
+        self.assertEqual(received.filter(purchase_price=Decimal('7.00'), sale_price=sale_price_for('7.00')).count(),
+                         count)
+        self.assertEqual(sorted(received.values_list('quantity', flat=True)), list(range(1, count + 1)))
+        self.assertEqual(SupplyProduct.objects.count(), count)
+
+    def test_supplier_of_another_company_is_rejected(self):
+        other, _ = create_tenant('other', products=1)
+        with self.assertRaises(ValidationError):
+            receive_supply(other.company, self.supplier.id, date(2026, 1, 1), [])
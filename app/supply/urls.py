@@ -1,11 +1,15 @@
 from django.urls import path
-from .views import ProductView, ProductIdView, SuplierView, SuplierIdView, SupplyView, SupplyCreateView
+from .views import ProductView, ProductIdView, SuplierView, SuplierIdView, SupplyView, SupplyCreateView, \
+    ImportView, SupplyExportView, StockExportView
 
 urlpatterns = [
     path('products/', ProductView.as_view(), name='products'),
+    path('products/export/', StockExportView.as_view(), name='products-export'),
     path('product/<int:pk>/', ProductIdView.as_view(), name='product'),
     path('suppliers/', SuplierView.as_view(), name='suppliers'),
     path('supplier/<int:pk>/', SuplierIdView.as_view(), name='supplier'),
     path('supplies/', SupplyView.as_view(), name='supply'),
+    path('supplies/export/', SupplyExportView.as_view(), name='supplies-export'),
     path('supply/', SupplyCreateView.as_view(), name='supply-create'),
+    path('import/<str:kind>/', ImportView.as_view(), name='import'),
 ]
@@ -1,15 +1,23 @@
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework import status
+from django.db import transaction
+from django.db.models import Prefetch
 
 from .models import Supply, Supplier, SupplyProduct, Product
 from .serializers import SupplySerializer, SupplierSerializer, SupplyProductSerializer, ProductSerializer, \
     SupplyCreateSerializer
 from company.permissions import IsCompanyEmployee
+from core.pagination import KeysetPagination
+from core.streaming import ExportSerializer, ExportContentNegotiation, streaming_export
+from sale.models import Sale, ProductSale
+from sale.services import recount_sale_totals
+from sale.rollups import record_sales, sale_lines, rebuild_rollups
+from sale.cache import bump_sales_version
 from .permissions import HasCompanyPermission, HasStoragePermission
-
-from decimal import Decimal
+from .importers import IMPORTERS, IMPORT_FORMATS, detect_format, read_rows
 
 
 class SuplierIdView(APIView):
@@ -22,8 +30,7 @@ class SuplierIdView(APIView):
         if pk is None:
             return Response({"detail": 'Вы не указали индекс'}, status=status.HTTP_400_BAD_REQUEST)
 
-        user = self.request.user
-        company = user.company
+        company = self.request.tenant.company
 
         try:
             supplier = Supplier.objects.get(pk=pk, company=company)
@@ -41,8 +48,7 @@ class SuplierIdView(APIView):
         if pk is None:
             return Response({"detail": 'Вы не указали индекс'}, status=status.HTTP_400_BAD_REQUEST)
 
-        user = self.request.user
-        company = user.company
+        company = self.request.tenant.company
         try:
             supplier = Supplier.objects.get(pk=pk, company=company)
         except Supplier.DoesNotExist:
@@ -62,8 +68,7 @@ class SuplierIdView(APIView):
         pk = kwargs.get('pk')
         if pk is None:
             return Response({"detail": 'Вы не указали индекс'}, status=status.HTTP_400_BAD_REQUEST)
-        user = self.request.user
-        company = user.company
+        company = self.request.tenant.company
         try:
             supplier = Supplier.objects.get(pk=pk, company=company)
         except Supplier.DoesNotExist:
@@ -84,23 +89,23 @@ class SuplierIdView(APIView):
 class SuplierView(APIView):
     permission_classes = [IsCompanyEmployee, HasCompanyPermission]
     serializer_class = SupplierSerializer
+    pagination_class = KeysetPagination
 
     def get(self, request, *args, **kwargs):
-        user = self.request.user
-        company = user.company
+        company = self.request.tenant.company
 
-        suppliers = Supplier.objects.filter(company=company)
-        suppliers_serializer = self.serializer_class(suppliers, many=True)
-        if not len(suppliers):
+        paginator = self.pagination_class()
+        suppliers = paginator.paginate_queryset(Supplier.objects.filter(company=company), request, view=self)
+        if not suppliers and not request.query_params.get(paginator.cursor_query_param):
             return Response(
                 {"detail": f"У компании нет поставщиков"},
                 status=status.HTTP_200_OK
             )
-        return Response(suppliers_serializer.data, status=status.HTTP_200_OK)
+        suppliers_serializer = self.serializer_class(suppliers, many=True)
+        return paginator.get_paginated_response(suppliers_serializer.data)
 
     def post(self, request, *args, **kwargs):
-        user = self.request.user
-        company = user.company
+        company = self.request.tenant.company
         suplier_serializer = self.serializer_class(data=request.data)
         if suplier_serializer.is_valid():
             suplier = suplier_serializer.save(company=company)
@@ -120,19 +125,23 @@ class SuplierView(APIView):
 class SupplyView(APIView):
     permission_classes = [IsAuthenticated, HasCompanyPermission, HasStoragePermission]
     serializer_class = SupplySerializer
+    pagination_class = KeysetPagination
+    ordering = ('-delivery_date', '-id')
 
     def get(self, request, *args, **kwargs):
-        company = self.request.user.company
+        company = self.request.tenant.company
         supplies = Supply.objects.filter(
             supplier__company=company
         ).select_related(
             'supplier'
         ).prefetch_related(
-            'supplyproduct_set__product'
-        ).order_by('-delivery_date')
+            Prefetch('supplyproduct_set', queryset=SupplyProduct.objects.select_related('product'))
+        )
 
-        serializer = SupplySerializer(supplies, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(supplies, request, view=self)
+        serializer = SupplySerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     permission_classes = [IsCompanyEmployee]
 
@@ -142,43 +151,12 @@ class SupplyCreateView(APIView):
     serializer_class = SupplyCreateSerializer
 
     def post(self, request, *args, **kwargs):
-        company = request.user.company
-        data = request.data
-        supply = None
-
-        try:
-            supplier = Supplier.objects.get(id=data['supplier_id'], company=company)
-            supply = Supply.objects.create(
-                supplier=supplier,
-                delivery_date=data['delivery_date']
-            )
-            storage = company.storage
-            for product_data in data['products']:
-                product = Product.objects.get(id=product_data['product_id'], storage=storage)
-                if product_data['quantity'] <= 0:
-                    return Response({"detail": f"Указано отрицательное количество товара {product.title}"},
-                                    status=status.HTTP_400_BAD_REQUEST)
-                product.quantity += product_data['quantity']
-                product.purchase_price = product_data['purchase_price']
-                product.sale_price = Decimal(product_data['purchase_price']) * Decimal('1.33')
-                product.save()
-                SupplyProduct.objects.create(
-                    supply=supply,
-                    product=product,
-                    quantity=product_data['quantity']
-                )
-            return Response(SupplyCreateSerializer(supply).data, status=201)
-        except Supplier.DoesNotExist:
-            return Response({"detail": "Поставщик не найден"}, status=status.HTTP_400_BAD_REQUEST
-                            )
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-        except Product.DoesNotExist:
-            if supply: supply.delete()
-            return Response({"detail": f"Товар {product_data['product_id']} не найден"},
-                            status=status.HTTP_400_BAD_REQUEST
-                            )
-        except KeyError:
-            return Response({"detail": 'Неверный формат данных'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 class ProductIdView(APIView):
@@ -186,7 +164,7 @@ class ProductIdView(APIView):
     serializer_class = ProductSerializer
 
     def get(self, request, *args, **kwargs):
-        storage = request.user.company.storage
+        storage = request.tenant.storage
 
         pk = kwargs.get('pk')
 
@@ -202,7 +180,7 @@ class ProductIdView(APIView):
         return Response(product_serializer.data)
 
     def patch(self, request, *args, **kwargs):
-        storage = request.user.company.storage
+        storage = request.tenant.storage
 
         pk = kwargs.get('pk')
         if not pk:
@@ -220,11 +198,12 @@ class ProductIdView(APIView):
         product_serializer = self.serializer_class(product, data=data, partial=True)
         if product_serializer.is_valid():
             product_serializer.save()
+            bump_sales_version(storage.company_id)
             return Response(product_serializer.data)
         return Response(product_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, *args, **kwargs):
-        storage = request.user.company.storage
+        storage = request.tenant.storage
 
         pk = kwargs.get('pk')
         if not pk:
@@ -235,23 +214,30 @@ class ProductIdView(APIView):
             return Response({"detail": f"Товар с индексом {pk} не найден"}, status=status.HTTP_400_BAD_REQUEST)
 
         title = product.title
-        product.delete()
+        with transaction.atomic():
+            product_sales = ProductSale.objects.filter(product=product)
+            record_sales(storage.company_id, sale_lines(product_sales), -1)
+            sale_ids = list(product_sales.values_list('sale_id', flat=True).distinct())
+            product.delete()
+            recount_sale_totals(Sale.objects.filter(id__in=sale_ids))
         return Response({"detail": f"Товар '{title}' удален"}, status=status.HTTP_200_OK)
 
 
 class ProductView(APIView):
     permission_classes = [IsCompanyEmployee, HasCompanyPermission, HasStoragePermission]
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
 
     def get(self, request, *args, **kwargs):
-        storage = request.user.company.storage
-        products = Product.objects.filter(storage=storage)
+        storage = request.tenant.storage
+        paginator = self.pagination_class()
+        products = paginator.paginate_queryset(Product.objects.filter(storage=storage), request, view=self)
         serializer = self.serializer_class(products, many=True)
 
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, *args, **kwargs):
-        storage = request.user.company.storage
+        storage = request.tenant.storage
         try:
             float(request.data.get('sale_price'))
         except ValueError:
@@ -269,10 +255,84 @@ class ProductView(APIView):
         return Response(product_serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, *args, **kwargs):
-        storage = request.user.company.storage
+        storage = request.tenant.storage
 
         products = Product.objects.filter(storage=storage)
-        deleted_count, _ = products.delete()
+        with transaction.atomic():
+            deleted_count, _ = products.delete()
+            recount_sale_totals(Sale.objects.filter(company_id=storage.company_id))
+            rebuild_rollups(storage.company_id)
         return Response({
             "detail": f"Удалено товаров: {deleted_count}"
         }, status=status.HTTP_200_OK)
+
+
+class ImportView(APIView):
+    permission_classes = [IsCompanyEmployee, HasCompanyPermission, HasStoragePermission]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        kind = kwargs.get('kind')
+        if kind not in IMPORTERS:
+            return Response({"detail": f"Неизвестный тип импорта {kind}, доступны: {', '.join(IMPORTERS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"detail": "Не передан файл"}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_format = request.data.get('file_format') or detect_format(upload.name)
+        if file_format not in IMPORT_FORMATS:
+            return Response({"detail": f"Неподдерживаемый формат {file_format}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        importer = IMPORTERS[kind](request.tenant.company)
+        report = importer.run(read_rows(upload, file_format))
+        return Response(report, status=status.HTTP_200_OK)
+
+
+class SupplyExportView(APIView):
+    permission_classes = [IsAuthenticated, HasCompanyPermission, HasStoragePermission]
+    serializer_class = ExportSerializer
+    content_negotiation_class = ExportContentNegotiation
+    columns = ('supply_id', 'delivery_date', 'supplier_id', 'supplier_title', 'supplier_inn', 'product_id',
+               'product_title', 'quantity')
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        lines = SupplyProduct.objects.filter(supply__supplier__company=request.tenant.company)
+        if data.get('start_date'):
+            lines = lines.filter(supply__delivery_date__gte=data['start_date'])
+        if data.get('end_date'):
+            lines = lines.filter(supply__delivery_date__lte=data['end_date'])
+        if data.get('product_id'):
+            lines = lines.filter(product_id=data['product_id'])
+        if data.get('supplier_id'):
+            lines = lines.filter(supply__supplier_id=data['supplier_id'])
+
+        lines = lines.order_by('supply_id', 'id').values_list(
+            'supply_id', 'supply__delivery_date', 'supply__supplier_id', 'supply__supplier__title',
+            'supply__supplier__inn', 'product_id', 'product__title', 'quantity',
+        )
+        return streaming_export('supplies', self.columns, lines, data['file_format'])
+
+
+class StockExportView(APIView):
+    permission_classes = [IsCompanyEmployee, HasCompanyPermission, HasStoragePermission]
+    serializer_class = ExportSerializer
+    content_negotiation_class = ExportContentNegotiation
+    columns = ('id', 'title', 'purchase_price', 'sale_price', 'quantity')
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        products = Product.objects.filter(storage=request.tenant.storage)
+        if data.get('product_id'):
+            products = products.filter(id=data['product_id'])
+
+        products = products.order_by('id').values_list(*self.columns)
+        return streaming_export('stock', self.columns, products, data['file_format'])